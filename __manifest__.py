@@ -6,7 +6,7 @@
     'author': '',
     'website': '',
     'category': '',
-    'depends': ['base', 'product', 'sale', 'project', 'import_folder_016', 'dev_insurances', 'dev_stock', 'exe_selsa_commission', 'account_invoice_pricelist'],
+    'depends': ['base', 'product', 'sale', 'project', 'stock', 'import_folder_016', 'dev_insurances', 'dev_stock', 'exe_selsa_commission', 'account_invoice_pricelist'],
     "data": [
         "security/ir.model.access.csv",
         "views/project_task_views.xml",
@@ -14,9 +14,11 @@
         "views/res_partner_views.xml",
         "views/sale_order_views.xml",
         "views/account_move_line_views.xml",
+        "views/project_task_billing_run_views.xml",
         "wizards/project_task_days_invoiced_wizard.xml",
         "wizards/project_task_fecha_ingreso_wizard.xml",
         "wizards/update_task_relations_wizard_view.xml",
+        "wizards/billing_forecast_wizard_view.xml",
         "data/ir_action_data.xml",
         "data/project_task_data.xml",
         "data/ir_cron.xml"
@@ -1,7 +1,138 @@
+import logging
+
 from odoo import api, SUPERUSER_ID
+from odoo.tools import split_every
+
+from odoo.addons.dev_invoice.models.batch_iteration import iter_record_chunks
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+
+def _sale_order_tasks_sql(env):
+    """SQL con los pares (orden de venta, tarea) de sale.order.task_ids, o None si el campo no se guarda en base"""
+    field = env['sale.order']._fields.get('task_ids')
+    if not field or not field.store:
+        return None
+    if field.type == 'many2many':
+        return f"SELECT {field.column1} AS order_id, {field.column2} AS task_id FROM {field.relation}"
+    if field.type == 'one2many':
+        inverse = env[field.comodel_name]._fields[field.inverse_name]
+        if inverse.store and inverse.type == 'many2one':
+            return f"SELECT {inverse.name} AS order_id, id AS task_id FROM {env[field.comodel_name]._table}"
+    return None
+
+
+def _rebuild_task_relations(env):
+    """
+    Reconstruye la tabla factura-tarea con SQL por conjuntos, con las mismas reglas que
+    account.move._get_importation_task_map: solo facturas y notas de crédito de cliente;
+    la tarea de la línea si su proyecto es de importación y, si no, las tareas de
+    importación (activas) de la orden de venta de la línea.
+
+    Devuelve (ids de facturas modificadas, ids de tareas afectadas).
+    """
+    cr = env.cr
+    field = env['account.move']._fields['task_id']
+    # Mismo filtro de líneas que el One2many invoice_line_ids (display_type)
+    line_query = env['account.move.line']._where_calc(env['account.move']._fields['invoice_line_ids'].domain or [])
+    line_from, line_where, line_params = line_query.get_sql()
+    sale_tasks_sql = _sale_order_tasks_sql(env)
+    sale_union = ''
+    if sale_tasks_sql:
+        # Las tareas de la orden solo cuentan si la línea no tiene una tarea de importación propia
+        sale_union = f"""
+        UNION
+        SELECT line.move_id, sale_task.task_id
+          FROM invoice_line line
+          JOIN ({sale_tasks_sql}) sale_task ON sale_task.order_id = line.sale_id
+          JOIN importation_task task ON task.id = sale_task.task_id AND task.active
+         WHERE line.task_id IS NULL
+            OR line.task_id NOT IN (SELECT id FROM importation_task)
+        """
+
+    cr.execute("DROP TABLE IF EXISTS dev_invoice_task_relation_tmp")
+    cr.execute(f"""
+        CREATE TEMPORARY TABLE dev_invoice_task_relation_tmp ON COMMIT DROP AS
+        WITH invoice_line AS (
+            SELECT "account_move_line".move_id, "account_move_line".task_id, "account_move_line".sale_id
+              FROM {line_from}
+              JOIN account_move move ON move.id = "account_move_line".move_id
+             WHERE ({line_where or 'TRUE'})
+               AND move.move_type IN ('out_invoice', 'out_refund')
+        ), importation_task AS (
+            SELECT task.id, task.active
+              FROM project_task task
+              JOIN project_project project ON project.id = task.project_id
+             WHERE project.importation
+        )
+        SELECT line.move_id, line.task_id
+          FROM invoice_line line
+          JOIN importation_task task ON task.id = line.task_id
+        {sale_union}
+    """, line_params)
+    _logger.info("Relaciones factura-tarea calculadas: %s pares", cr.rowcount)
+
+    cr.execute(f"""
+        DELETE FROM {field.relation} rel
+         WHERE NOT EXISTS (
+                SELECT 1 FROM dev_invoice_task_relation_tmp tmp
+                 WHERE tmp.move_id = rel.{field.column1} AND tmp.task_id = rel.{field.column2})
+     RETURNING rel.{field.column1}, rel.{field.column2}
+    """)
+    deleted = cr.fetchall()
+    _logger.info("Relaciones factura-tarea eliminadas: %s", len(deleted))
+
+    cr.execute(f"""
+        INSERT INTO {field.relation} ({field.column1}, {field.column2})
+        SELECT tmp.move_id, tmp.task_id
+          FROM dev_invoice_task_relation_tmp tmp
+         WHERE NOT EXISTS (
+                SELECT 1 FROM {field.relation} rel
+                 WHERE rel.{field.column1} = tmp.move_id AND rel.{field.column2} = tmp.task_id)
+     RETURNING {field.column1}, {field.column2}
+    """)
+    inserted = cr.fetchall()
+    _logger.info("Relaciones factura-tarea insertadas: %s", len(inserted))
+
+    pairs = deleted + inserted
+    return {move_id for move_id, task_id in pairs}, {task_id for move_id, task_id in pairs}
+
 
 def migrate(cr, version):
     env = api.Environment(cr, SUPERUSER_ID, {})
-    moves = env['account.move'].search([])
-    for move in moves:
-        move._update_task_relations()
\ No newline at end of file
+    moves_obj = env['account.move']
+    move_ids, task_ids = _rebuild_task_relations(env)
+
+    if not _sale_order_tasks_sql(env):
+        # sale.order.task_ids no está guardado en base: las facturas con órdenes de venta van por el ORM
+        _logger.info("Relaciones desde órdenes de venta: recorrido por el ORM")
+        domain = [('move_type', 'in', ['out_invoice', 'out_refund']), ('invoice_line_ids.sale_id', '!=', False)]
+        for moves in iter_record_chunks(moves_obj, domain, CHUNK_SIZE):
+            task_ids.update(moves.task_id.ids)
+            changed = moves._update_task_relations()
+            move_ids.update(changed.ids)
+            task_ids.update(changed.task_id.ids)
+
+    # Recalculo en bloque de los campos guardados que dependen de la relación
+    env.invalidate_all()
+    total = len(move_ids)
+    for done, chunk in enumerate(split_every(CHUNK_SIZE, sorted(move_ids)), 1):
+        moves_obj.browse(chunk).modified(['task_id'])
+        env.flush_all()
+        _logger.info("Recalculo por facturas: %s/%s", min(done * CHUNK_SIZE, total), total)
+        env.invalidate_all()
+
+    # La reconstrucción por SQL no pasa por los deltas del resumen de facturación
+    if 'project.task.billing.summary' in env:
+        env['project.task.billing.summary']._rebuild()
+        env.flush_all()
+
+    total = len(task_ids)
+    for done, chunk in enumerate(split_every(CHUNK_SIZE, sorted(task_ids)), 1):
+        tasks = env['project.task'].browse(chunk).exists()
+        tasks._compute_transit_total_cost()
+        env.flush_all()
+        _logger.info("Costo total de tránsito recalculado: %s/%s tareas", min(done * CHUNK_SIZE, total), total)
+        env.invalidate_all()
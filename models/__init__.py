@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
 
+from . import debug_logging
 from . import product_template
+from . import product_product
+from . import product_category
+from . import res_currency
+from . import res_currency_rate
 from . import project_task
+from . import project_task_billing_run
+from . import project_task_billing_summary
 from . import res_partner_inherit
 from . import account_move_line_inherit
 from . import account_move_inherit
-from . import sale_order_inherit
\ No newline at end of file
+from . import sale_order_inherit
+from . import stock_lot
+from . import stock_quant
+from . import update_task_relations_job
\ No newline at end of file
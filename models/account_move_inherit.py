@@ -1,140 +1,424 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
+from odoo.exceptions import ValidationError
 
 import logging
+from collections import defaultdict
 from datetime import datetime, timedelta
 
+from odoo.tools import split_every
+
+from .batch_iteration import iter_record_chunks
+from .cron_budget import CronBudget, trigger_cron
+
 _logger = logging.getLogger(__name__)
 
+# Marca de agua (write_date) de la última actualización incremental de relaciones factura-tarea
+TASK_RELATIONS_WATERMARK_PARAM = 'dev_invoice.task_relations_watermark'
+WATERMARK_OVERLAP = timedelta(minutes=15)
+TASK_RELATIONS_BATCH_SIZE = 500
+# Pasada en curso del cron cortada por presupuesto: "último id,inicio de la pasada,completa" (ir.config_parameter)
+TASK_RELATIONS_CURSOR_PARAM = 'dev_invoice.task_relations_cursor'
+# Clave en cr.precommit.data con las facturas cuya relación con tareas queda por revisar
+PENDING_TASK_RELATIONS_KEY = 'dev_invoice.pending_task_relations'
+
 class AccountMoveInherit(models.Model):
-    _inherit = 'account.move'
+    _name = 'account.move'
+    _inherit = ['account.move', 'dev.invoice.debug.mixin']
 
+    # Mantenida solo por _update_task_relations, una vez por transacción para las facturas modificadas
     task_id = fields.Many2many('project.task', 
                              string='Carpeta de importación', 
-                             compute='_compute_task_id',
-                             store=True)
-
-    @api.depends('invoice_line_ids.task_id', 'invoice_line_ids.sale_id.task_ids', 'move_type')
-    def _compute_task_id(self):
-        for rec in self:
-            # Solo procesar facturas salientes y notas de crédito
-            if rec.move_type not in ['out_invoice', 'out_refund']:
-                rec.task_id = [(5, 0, 0)]  # Limpiamos las relaciones
-                continue
-                
-            task_ids = []
-            _logger.info(f"Procesando cálculo de task_id para {rec.move_type} {rec.id}")
-            
-            for line in rec.invoice_line_ids:
-                # Primero verificamos si la línea tiene una tarea directamente asociada
-                if line.task_id and line.task_id.project_id.importation:
-                    # Solo agregar tareas cuyo project_id tiene importation=True
-                    task_ids.append(line.task_id.id)
-                    _logger.info(f"Línea {line.id} asociada directamente a tarea {line.task_id.id}")
-                
-                # Si no tiene tarea directa pero tiene orden de venta, buscamos en las tareas de la orden
-                elif line.sale_id:
-                    task_ids.extend(
-                        task.id 
-                        for task in line.sale_id.task_ids 
-                        if task.project_id.importation
-                    )
-                    if task_ids:
-                        _logger.info(f"Orden de venta {line.sale_id.id} asociada a tareas: {task_ids}")
-            
-            # Eliminamos duplicados y asignamos las tareas
-            rec.task_id = [(6, 0, list(set(task_ids)))]
-            if task_ids:
-                _logger.info(f"Tareas finales para {rec.move_type} {rec.id}: {list(set(task_ids))}")
+                             readonly=True)
+    # Vista al momento de task_id (formularios, onchange): refleja las líneas aún no guardadas o sin aplicar
+    current_task_ids = fields.Many2many('project.task', string='Carpetas de importación (actuales)',
+                                        compute='_compute_current_task_ids')
 
-    @api.model
-    def create(self, vals):
-        record = super(AccountMoveInherit, self).create(vals)
-        record._update_task_relations()
-        return record
+    @api.depends('move_type', 'invoice_line_ids.task_id', 'invoice_line_ids.sale_id')
+    def _compute_current_task_ids(self):
+        task_map = self._get_importation_task_map()
+        for move in self:
+            move.current_task_ids = [(6, 0, list(task_map[move]))]
+
+    def _get_importation_task_map(self):
+        """
+        Devuelve {factura: set(ids de tareas)} con las tareas de importación de cada factura.
+
+        Solo las facturas salientes y notas de crédito tienen tareas: primero la tarea de la línea
+        (si su proyecto es de importación) y, si no, las tareas de importación de su orden de venta.
+        Las tareas y órdenes de todo el conjunto se resuelven juntas, con una sola consulta
+        para filtrar los proyectos de importación.
+        """
+        out_moves = self.filtered(lambda move: move.move_type in ['out_invoice', 'out_refund'])
+        lines = out_moves.invoice_line_ids
+        candidate_ids = set(lines.task_id.ids) | set(lines.sale_id.task_ids.ids)
+        importation_ids = set()
+        if candidate_ids:
+            importation_ids = set(self.env['project.task'].sudo().with_context(active_test=False).search([
+                ('id', 'in', list(candidate_ids)),
+                ('project_id.importation', '=', True),
+            ]).ids)
+
+        task_map = {}
+        for move in self:
+            task_ids = set()
+            if move in out_moves:
+                for line in move.invoice_line_ids:
+                    # Primero verificamos si la línea tiene una tarea de importación directamente asociada
+                    if line.task_id.id in importation_ids:
+                        task_ids.add(line.task_id.id)
+                    # Si no, buscamos en las tareas de la orden de venta
+                    elif line.sale_id:
+                        task_ids.update(task_id for task_id in line.sale_id.task_ids.ids if task_id in importation_ids)
+            task_map[move] = task_ids
+        return task_map
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(AccountMoveInherit, self).create(vals_list)
+        records._mark_task_relations_dirty()
+        return records
 
     def write(self, vals):
+        was_posted = self.browse()
+        if 'state' in vals:
+            # Relaciones al día antes del cambio de estado, para que el resumen use las tareas correctas
+            self._flush_pending_task_relations()
+            was_posted = self.filtered(lambda move: move.state == 'posted')
         res = super(AccountMoveInherit, self).write(vals)
-        if 'invoice_line_ids' in vals:
-            self._update_task_relations()
+        if 'invoice_line_ids' in vals or 'move_type' in vals:
+            self._mark_task_relations_dirty()
+        if 'state' in vals:
+            # Publicación, vuelta a borrador y cancelación pasan por aquí
+            is_posted = self.filtered(lambda move: move.state == 'posted')
+            summary_obj = self.env['project.task.billing.summary'].sudo()
+            summary_obj._apply_move_deltas(is_posted - was_posted, 1)
+            summary_obj._apply_move_deltas(was_posted - is_posted, -1)
+            # Las tareas de las facturas canceladas vuelven a quedar pendientes de facturar en su período
+            cancelled = self.filtered(lambda move: move.state == 'cancel')
+            if cancelled:
+                self.env['project.task.billing.run.line'].sudo()._reset_for_invoices(cancelled)
         return res
 
+    def _mark_task_relations_dirty(self):
+        """
+        Anota las facturas cuya relación con tareas debe revisarse. La revisión se hace una sola
+        vez, antes del commit, para todas las facturas anotadas en la transacción.
+        """
+        move_ids = [move_id for move_id in self.ids if move_id]
+        if not move_ids:
+            return
+        data = self.env.cr.precommit.data
+        pending = data.get(PENDING_TASK_RELATIONS_KEY)
+        if pending is None:
+            pending = data[PENDING_TASK_RELATIONS_KEY] = set()
+            self.env.cr.precommit.add(self.env['account.move'].sudo()._flush_pending_task_relations)
+        pending.update(move_ids)
+
+    @api.model
+    def _flush_pending_task_relations(self):
+        """Aplica las actualizaciones de relaciones pendientes; llamarlo antes de leer task_id en la misma transacción"""
+        move_ids = self.env.cr.precommit.data.pop(PENDING_TASK_RELATIONS_KEY, None)
+        if not move_ids:
+            return
+        self.env.flush_all()
+        # Las facturas creadas dentro de un savepoint revertido ya no existen
+        self.browse(move_ids).exists()._update_task_relations()
+        self.env.flush_all()
+
     def _update_task_relations(self):
         """
-        Actualiza las relaciones de tareas solo cuando es necesario
+        Sincroniza la relación factura-tarea aplicando solo las diferencias: inserta los pares
+        nuevos y borra los que sobran, sin tocar las filas que no cambian.
+
+        Devuelve las facturas cuya relación cambió.
+        """
+        moves = self.filtered('id')
+        if not moves:
+            return self.browse()
+        trace = self._debug_trace('_update_task_relations')
+        cr = self.env.cr
+        field = self._fields['task_id']
+        task_map = moves._get_importation_task_map()
+
+        self.flush_model(['task_id'])
+        cr.execute(f"""
+            SELECT {field.column1}, {field.column2}
+              FROM {field.relation}
+             WHERE {field.column1} IN %s
+        """, [tuple(moves.ids)])
+        existing = defaultdict(set)
+        for move_id, task_id in cr.fetchall():
+            existing[move_id].add(task_id)
+
+        to_insert = []
+        to_delete = []
+        for move in moves:
+            wanted = task_map[move]
+            current = existing[move.id]
+            to_insert.extend((move.id, task_id) for task_id in wanted - current)
+            to_delete.extend((move.id, task_id) for task_id in current - wanted)
+            if wanted != current:
+                trace.log("Tareas actualizadas para factura %s: %s", move.id, sorted(wanted))
+
+        for pairs in split_every(TASK_RELATIONS_BATCH_SIZE, to_insert):
+            cr.execute(f"""
+                INSERT INTO {field.relation} ({field.column1}, {field.column2})
+                VALUES {", ".join(["%s"] * len(pairs))}
+                ON CONFLICT DO NOTHING
+            """, pairs)
+        if to_delete:
+            cr.execute(f"""
+                DELETE FROM {field.relation}
+                 WHERE ({field.column1}, {field.column2}) IN %s
+            """, [tuple(to_delete)])
+
+        # Las facturas ya publicadas suman o restan su importe en el resumen de las tareas
+        summary_obj = self.env['project.task.billing.summary'].sudo()
+        summary_obj._apply_relation_deltas(to_insert, 1)
+        summary_obj._apply_relation_deltas(to_delete, -1)
+
+        changed = self.browse({move_id for move_id, task_id in to_insert + to_delete})
+        if changed:
+            changed.invalidate_recordset(['task_id'])
+            # Campos de las tareas que comparten la tabla de relación (inversos del Many2many)
+            task_model = self.env['project.task']
+            inverse_fields = [
+                name for name, task_field in task_model._fields.items()
+                if task_field.type == 'many2many' and task_field.store and task_field.relation == field.relation
+            ]
+            if inverse_fields:
+                task_model.browse({task_id for move_id, task_id in to_insert + to_delete}).invalidate_recordset(inverse_fields)
+            changed.modified(['task_id'])
+
+        trace.count('facturas', len(moves))
+        trace.count('actualizadas', len(changed))
+        trace.count('pares_insertados', len(to_insert))
+        trace.count('pares_borrados', len(to_delete))
+        trace.summary()
+        return changed
+
+    def _update_task_relations_safe(self):
+        """
+        Actualiza las relaciones del lote en una sola pasada; si falla, reintenta factura por
+        factura para aislar el error. Devuelve (facturas actualizadas, [(factura, error)]).
+        """
+        try:
+            with self.env.cr.savepoint():
+                return self._update_task_relations(), []
+        except Exception:
+            _logger.warning("Error al actualizar relaciones del lote de %s facturas, reintentando una por una", len(self))
+        changed = self.browse()
+        errors = []
+        for move in self:
+            try:
+                with self.env.cr.savepoint():
+                    changed |= move._update_task_relations()
+            except Exception as e:
+                _logger.error("Error al procesar factura %s: %s", move.id, e)
+                errors.append((move, e))
+        return changed, errors
+
+    @api.model
+    def _assemble_invoices(self, vals_list, reprice=True):
+        """
+        Crea las facturas con sus líneas (comandos ``invoice_line_ids`` ya armados en ``vals_list``)
+        en un solo ``create`` y actualiza los precios según la lista de precios una vez al final.
+        Con ``reprice=False`` la actualización de precios queda a cargo de quien llama.
+        """
+        invoices = self.create(vals_list)
+        # Quien llama lee task_id de las facturas nuevas en la misma transacción
+        self._flush_pending_task_relations()
+        if reprice:
+            invoices._check_reprice_errors(invoices._reprice_from_pricelist())
+        return invoices
+
+    @api.model
+    def _check_reprice_errors(self, errors):
+        """Corta la facturación si alguna factura no pudo tomar los precios de su lista de precios"""
+        if errors:
+            raise ValidationError("No se pudieron actualizar los precios de las facturas:\n%s" % "\n".join(
+                f"{move.partner_id.display_name} ({move.invoice_origin or move.id}): {error}" for move, error in errors.items()))
+
+    def _reprice_from_pricelist(self):
+        """
+        Actualiza los precios de las facturas en borrador según su lista de precios, en lote.
+
+        Las líneas comunes se agrupan por (lista, producto, fecha, cantidad, unidad, moneda,
+        compañía, posición fiscal): cada combinación se evalúa una sola vez y el precio y el
+        descuento (los mismos campos que ``button_update_prices_from_pricelist``) se escriben
+        juntos a todas sus líneas. Las líneas ``calculate_custom`` se recalculan juntas con su
+        cálculo propio.
+
+        Devuelve {factura: mensaje de error} con las facturas que no se pudieron actualizar.
         """
-        for rec in self:
-            task_ids = []
-            _logger.info(f"Actualizando relaciones de tareas para factura {rec.id}")
-            for line in rec.invoice_line_ids:
-                if line.task_id and line.task_id.project_id.importation:
-                    task_ids.append(line.task_id.id)
-                    _logger.info(f"Línea {line.id} asociada a la tarea {line.task_id.id}")
-                elif line.sale_id and line.sale_id.task_ids:
-                    for task in line.sale_id.task_ids:
-                        if task.project_id.importation:
-                            task_ids.append(task.id)
-                            _logger.info(f"Orden de venta {line.sale_id.id} asociada a la tarea {task.id}")
-            
-            if set(task_ids) != set(rec.task_id.ids):
-                rec.task_id = [(6, 0, task_ids)]
-                _logger.info(f"Tareas actualizadas para factura {rec.id}: {task_ids}")
-
-    def post(self):
-        res = super(AccountMoveInherit, self).post()
-        for rec in self:
-            if rec.invoice_origin and 'Storage' in rec.invoice_origin.lower():
+        trace = self._debug_trace('_reprice_from_pricelist')
+        errors = {}
+        moves = self.filtered(lambda move: move.state == 'draft' and move.pricelist_id)
+        lines = moves.invoice_line_ids.filtered('product_id')
+        line_obj = self.env['account.move.line'].with_context(check_move_validity=False)
+
+        groups = defaultdict(lambda: line_obj)
+        for line in lines.filtered(lambda line: not line.calculate_custom):
+            move = line.move_id
+            key = (move.pricelist_id.id, line.product_id.id, move.invoice_date, line.quantity,
+                   line.product_uom_id.id, move.currency_id.id, move.company_id.id, move.fiscal_position_id.id)
+            groups[key] |= line
+
+        lines_by_price = defaultdict(lambda: line_obj)
+        for group in groups.values():
+            line = group[0]
+            try:
+                # Con descuentos visibles la lista de precios deja el descuento en la línea evaluada
+                price = line._get_price_with_pricelist()
+            except Exception as e:
+                for move in group.move_id:
+                    errors[move] = str(e)
+                continue
+            lines_by_price[(price, line.discount)] |= group
+        trace.count('combinaciones', len(groups))
+
+        def apply(records, method):
+            # Todo el lote en un solo paso; si falla, factura por factura para aislar el error
+            records = records.filtered(lambda line: line.move_id not in errors)
+            if not records:
+                return
+            try:
+                with self.env.cr.savepoint():
+                    method(records)
+                return
+            except Exception:
+                if len(records.move_id) == 1:
+                    _logger.exception("Error al actualizar precios para la factura %s", records.move_id.id)
+                    errors[records.move_id] = "Error al actualizar precios"
+                    return
+            for move in records.move_id:
+                try:
+                    with self.env.cr.savepoint():
+                        method(records.filtered(lambda line: line.move_id == move))
+                except Exception as e:
+                    errors[move] = str(e)
+
+        for (price, discount), group in lines_by_price.items():
+            apply(group, lambda records: records.write({'price_unit': price, 'discount': discount}))
+        apply(lines.filtered('calculate_custom').with_context(check_move_validity=False),
+              lambda records: records._compute_price_unit())
+
+        for move, error in errors.items():
+            _logger.error("Error al actualizar precios para la factura %s: %s", move.id, error)
+        trace.count('facturas', len(moves))
+        trace.count('lineas', len(lines))
+        trace.count('errores', len(errors))
+        trace.summary()
+        return errors
+
+    def _post(self, soft=True):
+        res = super(AccountMoveInherit, self)._post(soft)
+        self._flush_pending_task_relations()
+        trace = self._debug_trace('_post')
+        # Próxima facturación a 30 días de la factura de almacenamiento; un write por fecha
+        tasks_by_date = defaultdict(lambda: self.env['project.task'])
+        for rec in self.filtered(lambda move: move.state == 'posted'):
+            if rec.invoice_origin and 'storage' in rec.invoice_origin.lower():
                 if rec.invoice_date:
-                    _logger.info(f"Procesando cálculo de próxima fecha de facturación para factura {rec.id}")
-                    for task in rec.task_id:
-                        # Calcular la fecha 30 días después de la fecha de la factura
-                        next_billing_date = rec.invoice_date + timedelta(days=30)
-                        task.date_next_billing = next_billing_date
-                        _logger.info(f"Actualizada la próxima fecha de facturación para la tarea {task.id}: {next_billing_date}")
+                    trace.log("Procesando cálculo de próxima fecha de facturación para factura %s", rec.id)
+                    tasks_by_date[rec.invoice_date + timedelta(days=30)] |= rec.task_id
                 else:
-                    _logger.warning(f"La factura {rec.id} no tiene una fecha de factura válida.")
+                    _logger.warning("La factura %s no tiene una fecha de factura válida.", rec.id)
+        for next_billing_date, tasks in tasks_by_date.items():
+            tasks.write({'date_next_billing': next_billing_date})
+            trace.log("Actualizada la próxima fecha de facturación para las tareas %s: %s", tasks.ids, next_billing_date)
+            trace.count('tareas', len(tasks))
+        trace.summary()
         return res
 
     def unlink(self):
-        for rec in self:
-            if rec.invoice_origin and 'storage' in rec.invoice_origin.lower():
-                _logger.info(f"Eliminando la fecha de próxima facturación para las tareas asociadas a la factura {rec.id}")
-                for task in rec.task_id:
-                    task.date_next_billing = False
-                    _logger.info(f"Fecha de próxima facturación eliminada para la tarea {task.id}")
+        self._flush_pending_task_relations()
+        trace = self._debug_trace('unlink')
+        storage_moves = self.filtered(lambda rec: rec.invoice_origin and 'storage' in rec.invoice_origin.lower())
+        if storage_moves:
+            trace.log("Eliminando la fecha de próxima facturación para las tareas asociadas a las facturas %s", storage_moves.ids)
+            storage_moves.task_id.write({'date_next_billing': False})
+            trace.count('tareas', len(storage_moves.task_id))
+        trace.summary()
+        self.env['project.task.billing.summary'].sudo()._apply_move_deltas(
+            self.filtered(lambda move: move.state == 'posted'), -1)
+        # Las tareas de las facturas eliminadas vuelven a quedar pendientes de facturar en su período
+        self.env['project.task.billing.run.line'].sudo().search([('invoice_id', 'in', self.ids)]).unlink()
         res = super(AccountMoveInherit, self).unlink()
 
         return res
 
     @api.model
-    def _cron_update_task_relations(self):
+    def _get_task_relations_domain(self, since=None):
+        """Facturas y notas de crédito de cliente a revisar; con ``since`` solo las afectadas por cambios posteriores"""
+        domain = [('move_type', 'in', ['out_invoice', 'out_refund'])]
+        if since:
+            # Proyectos modificados (p. ej. el indicador importation) desde la marca de agua
+            projects = self.env['project.project'].with_context(active_test=False).search([('write_date', '>', since)])
+            # Tareas modificadas (proyecto, orden de venta, archivado): sus facturas actuales y las candidatas
+            tasks = self.env['project.task'].with_context(active_test=False).search([('write_date', '>', since)])
+            domain += [
+                '|', '|', '|', '|', '|', '|', '|',
+                ('write_date', '>', since),
+                ('invoice_line_ids.write_date', '>', since),
+                ('invoice_line_ids.sale_id.write_date', '>', since),
+                ('invoice_line_ids.task_id.project_id', 'in', projects.ids),
+                ('invoice_line_ids.sale_id.task_ids.project_id', 'in', projects.ids),
+                ('invoice_line_ids.task_id', 'in', tasks.ids),
+                ('invoice_line_ids.sale_id.task_ids', 'in', tasks.ids),
+                ('task_id', 'in', tasks.ids),
+            ]
+        return domain
+
+    @api.model
+    def _cron_update_task_relations(self, full=False, time_budget=None, record_budget=None):
         """
-        Método para ser llamado por el cron que actualiza las relaciones entre facturas y tareas
+        Método para ser llamado por el cron que actualiza las relaciones entre facturas y tareas.
+
+        Por defecto solo revisa las facturas modificadas desde la última ejecución (marca de agua
+        guardada en ir.config_parameter); ``full=True`` reconstruye todas las relaciones.
+
+        Cada lote se confirma junto con el punto de control de la pasada. Al agotar el presupuesto
+        (``CronBudget``) la ejecución termina y vuelve a programar el cron, que sigue la misma
+        pasada desde la factura siguiente; la marca de agua avanza solo al completarla.
         """
-        _logger.info("Iniciando actualización programada de relaciones de facturas con tareas")
-        moves = self.search([])
-        count = 0
-        
-        for move in moves:
-            try:
-                task_ids = []
-                for line in move.invoice_line_ids:
-                    if line.task_id and line.task_id.project_id.importation:
-                        task_ids.append(line.task_id.id)
-                    elif line.sale_id and line.sale_id.task_ids:
-                        task_ids.extend(
-                            task.id 
-                            for task in line.sale_id.task_ids 
-                            if task.project_id.importation
-                        )
-                
-                if set(task_ids) != set(move.task_id.ids):
-                    move.task_id = [(6, 0, list(set(task_ids)))]
-                    count += 1
-                    self.env.cr.commit()  # Commit por cada actualización exitosa
-                    
-            except Exception as e:
-                _logger.error(f"Error al procesar factura {move.id}: {str(e)}")
-                self.env.cr.rollback()
-                
-        _logger.info(f"Actualización completada. Se actualizaron {count} facturas")
\ No newline at end of file
+        budget = CronBudget(self.env, time_budget, record_budget)
+        ICP = self.env['ir.config_parameter'].sudo()
+        start_after = 0
+        run_start = fields.Datetime.now()
+        cursor = ICP.get_param(TASK_RELATIONS_CURSOR_PARAM)
+        if cursor and not full:
+            # Continuación de una pasada cortada por presupuesto, con su inicio y su alcance
+            last_id, pass_start, pass_full = cursor.split(',')
+            start_after = int(last_id)
+            run_start = fields.Datetime.to_datetime(pass_start)
+            full = pass_full == '1'
+        watermark = ICP.get_param(TASK_RELATIONS_WATERMARK_PARAM)
+        since = False
+        if watermark and not full:
+            # Margen para no perder cambios de transacciones que confirmaron durante la ejecución anterior
+            since = fields.Datetime.to_datetime(watermark) - WATERMARK_OVERLAP
+
+        _logger.info("Iniciando actualización programada de relaciones de facturas con tareas (desde: %s, factura: %s)",
+                     since or 'inicio', start_after)
+        scanned = count = 0
+
+        domain = self._get_task_relations_domain(since)
+        for moves in iter_record_chunks(self, domain, TASK_RELATIONS_BATCH_SIZE, start_after):
+            changed, errors = moves._update_task_relations_safe()
+            scanned += len(moves)
+            count += len(changed)
+            ICP.set_param(TASK_RELATIONS_CURSOR_PARAM, ','.join([
+                str(moves[-1].id), fields.Datetime.to_string(run_start), '1' if full else '0']))
+            budget.consume(len(moves))
+            self.env.cr.commit()  # Commit por lote procesado, junto con el punto de control
+            if budget.exhausted:
+                trigger_cron(self.env, 'dev_invoice.ir_cron_update_task_relations')
+                _logger.info("Actualización parcial: se revisaron %s facturas y se actualizaron %s; continúa desde la factura %s",
+                             scanned, count, moves[-1].id)
+                return
+
+        ICP.set_param(TASK_RELATIONS_CURSOR_PARAM, False)
+        ICP.set_param(TASK_RELATIONS_WATERMARK_PARAM, fields.Datetime.to_string(run_start))
+        _logger.info("Actualización completada. Se revisaron %s facturas y se actualizaron %s", scanned, count)
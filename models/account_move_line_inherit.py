@@ -5,8 +5,12 @@ import logging
 
 _logger = logging.getLogger(__name__)
 
+# Campos de la línea que determinan las tareas de importación de su factura
+TASK_RELATION_FIELDS = ('task_id', 'sale_id', 'move_id', 'display_type')
+
 class AccountMoveLineInherit(models.Model):
-    _inherit = 'account.move.line'
+    _name = 'account.move.line'
+    _inherit = ['account.move.line', 'dev.invoice.debug.mixin']
 
     task_id = fields.Many2one(
         'project.task',
@@ -36,196 +40,154 @@ class AccountMoveLineInherit(models.Model):
         store=True,
     )
 
-    @api.depends("quantity", "days_storage", "product_id", "calculate_custom")
+    @api.depends("quantity", "days_storage", "fob_total", "product_id", "calculate_custom")
     def _compute_price_unit(self):
         super()._compute_price_unit()
+        trace = self._debug_trace('_compute_price_unit')
         for line in self:
-            _logger.info(f"[CUSTOM DEBUG] Procesando línea ID: {line.id or 'nuevo'} - Producto: {line.product_id.display_name if line.product_id else 'N/A'}")
-
-            if not line.move_id.pricelist_id:
-                _logger.info("[CUSTOM DEBUG] No hay lista de precios. Se omite.")
-                continue
+            if trace.verbose:
+                trace.log("Procesando línea ID: %s - Producto: %s", line.id or 'nuevo', line.product_id.display_name or 'N/A')
 
             if line.calculate_custom and line.product_id:
-                product = line.product_id
-                _logger.info(f"[CUSTOM DEBUG] Aplica lógica personalizada para producto: {product.display_name}")
-
-                usd_currency = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-                rate = 1.0
-                if usd_currency:
-                    rate_data = usd_currency._get_rates(self.env.company, fields.Date.context_today(self))
-                    rate = 1 / rate_data.get(usd_currency.id, 1.0)
-                _logger.info(f"[CUSTOM DEBUG] Tasa de cambio USD: {rate}")
-
-                if product.fob_total:
-                    subtotal = line.fob_total * rate * 0.001
-                    if subtotal < product.min_price:
-                        line.update({
-                            'price_unit': product.min_price,
-                            'quantity': 1,
-                        })
-
-                elif product.is_storage:
-                    subtotal = line.quantity * line.days_storage * line.price_unit
-                    if subtotal < product.min_price:
-                        # Aseguramos que el precio unitario resulte en el monto mínimo exacto
-                        if line.quantity and line.days_storage:
-                            new_price_unit = product.min_price / (line.quantity * line.days_storage)
-                            # Ajustamos el precio unitario con más precisión decimal
-                            line.with_context(check_move_validity=False).price_unit = round(new_price_unit, 6)
-                            _logger.info(f"[CUSTOM DEBUG] Precio mínimo ajustado - Nuevo precio unitario: {new_price_unit}")
-                
-                continue
-
-            _logger.info("[CUSTOM DEBUG] Aplica lógica de pricelist.")
-            line.with_context(check_move_validity=False).price_unit = line._get_price_with_pricelist()
-
-    @api.depends('quantity', 'price_unit', 'tax_ids', 'currency_id', 'product_id', 'days_storage', 'calculate_custom')
-    def _compute_price_subtotal(self):
-        super()._compute_price_subtotal()
-        
-        for line in self:
-            if not line.calculate_custom or not line.product_id:
-                continue
-
-            # Obtener tasa de cambio USD al inicio
-            usd_currency = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-            rate = 1.0
-            if usd_currency:
-                rate_data = usd_currency._get_rates(self.env.company, fields.Date.context_today(self))
-                rate = 1 / rate_data.get(usd_currency.id, 1.0)
-                _logger.info(f"[CUSTOM DEBUG] Tasa de cambio USD: {rate}")
-
-            product = line.product_id
-            if product.product_tmpl_id.is_storage:
-                base_subtotal = line.quantity * line.days_storage * line.price_unit
-                
-                if base_subtotal < product.product_tmpl_id.min_price:
-                    # Ajustamos el precio unitario para que el subtotal sea exactamente el precio mínimo
-                    new_price_unit = product.product_tmpl_id.min_price / (line.quantity * line.days_storage)
-                    line.with_context(check_move_validity=False).write({
-                        'price_unit': round(new_price_unit, 6),
-                        'price_subtotal': product.product_tmpl_id.min_price
-                    })
-                    _logger.info(f"""[CUSTOM DEBUG] Ajuste a precio mínimo:
-                        - Precio unitario ajustado: {new_price_unit}
-                        - Subtotal final: {product.product_tmpl_id.min_price}
-                    """)
-                else:
-                    line.price_subtotal = round(base_subtotal, 2)
-                
+                # super() deja el precio de lista del producto: es la tarifa base del cálculo propio
+                if trace.verbose:
+                    trace.log("Aplica lógica personalizada para producto: %s", line.product_id.display_name)
+                trace.count('custom')
+                line.with_context(check_move_validity=False).price_unit = line._get_computed_price()
                 continue
 
-            # Cálculo para productos FOB
-            if product.product_tmpl_id.fob_total:
-                subtotal = line.fob_total * rate * 0.001
-                _logger.info(f"[CUSTOM DEBUG] Cálculo FOB - fob total: {line.fob_total} * Rate: {rate} * 0.001")
-                
-                if subtotal < product.product_tmpl_id.min_price:
-                    subtotal = product.product_tmpl_id.min_price
-                    _logger.info(f"[CUSTOM DEBUG] Se aplica precio mínimo: {subtotal}")
-
-            # Cálculo para productos de almacenamiento
-            elif product.product_tmpl_id.is_storage:
-                # Calculamos el subtotal normal
-                base_subtotal = line.quantity * line.days_storage * line.price_unit
-                
-                # Aplicamos el precio mínimo si corresponde
-                line.price_subtotal = max(base_subtotal, product.product_tmpl_id.min_price)
-                
-                _logger.info(f"""[CUSTOM DEBUG] Cálculo Storage:
-                    - Base subtotal: {base_subtotal}
-                    - Precio mínimo: {product.product_tmpl_id.min_price}
-                    - Subtotal final: {line.price_subtotal}
-                """)
-
-            else:
-                _logger.info("[CUSTOM DEBUG] No aplica cálculo especial")
+            if not line.move_id.pricelist_id:
+                trace.log("No hay lista de precios. Se omite.")
+                trace.count('sin_lista')
                 continue
 
-            # Actualizamos el subtotal
-            line.price_subtotal = subtotal
-            _logger.info(f"[CUSTOM DEBUG] Subtotal final: {subtotal}")
+            trace.log("Aplica lógica de pricelist.")
+            trace.count('pricelist')
+            line.with_context(check_move_validity=False).price_unit = line._get_price_with_pricelist()
+        trace.summary()
 
-    @api.depends('quantity', 'price_unit', 'product_id', 'days_storage', 'calculate_custom', 'move_id.currency_id', 'move_id.date')
+    @api.depends('quantity', 'price_unit', 'product_id', 'fob_total', 'calculate_custom', 'move_id.currency_id', 'move_id.date')
     def _compute_custom_subtotal(self):
+        trace = self._debug_trace('_compute_custom_subtotal')
         for line in self:
             if not line.calculate_custom or not line.product_id:
                 line.custom_subtotal = 0.0
                 continue
 
-            product = line.product_id
-            
             # Obtener tasa de cambio
-            usd_currency = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-            rate = 1.0
-            if usd_currency:
-                rate_data = usd_currency._get_rates(self.env.company, line.move_id.date or fields.Date.context_today(self))
-                rate = 1 / rate_data.get(usd_currency.id, 1.0)
-                _logger.info(f"[CUSTOM DEBUG] Tasa de cambio USD: {rate}")
-
-            # Cálculo para productos FOB
-            if product.product_tmpl_id.fob_total:
-                subtotal = line.fob_total * rate * 0.001
-                _logger.info(f"[CUSTOM DEBUG] Cálculo FOB - fob total: {line.fob_total} * Rate: {rate} * 0.001 = {subtotal}")
-
-                if subtotal < product.product_tmpl_id.min_price:
-                    subtotal = product.product_tmpl_id.min_price
-                    _logger.info(f"[CUSTOM DEBUG] Se aplica precio mínimo FOB: {subtotal}")
-
-            # Cálculo para productos de almacenamiento
-            elif product.product_tmpl_id.is_storage:
-                subtotal = line.quantity * line.days_storage * line.price_unit
-                _logger.info(f"[CUSTOM DEBUG] Cálculo Storage - Cantidad: {line.quantity} * Días: {line.days_storage} * Precio: {line.price_unit} = {subtotal}")
-                
-                if subtotal < product.product_tmpl_id.min_price:
-                    subtotal = product.product_tmpl_id.min_price
-                    _logger.info(f"[CUSTOM DEBUG] Se aplica precio mínimo Storage: {subtotal}")
-
-            else:
-                subtotal = line.price_unit * line.quantity
-                _logger.info(f"[CUSTOM DEBUG] Cálculo normal: {subtotal}")
-
-            line.custom_subtotal = subtotal
+            rate = self.env['res.currency']._get_usd_rate(self.env.company, line.move_id.date or fields.Date.context_today(self))
+            trace.log("Tasa de cambio USD: %s", rate)
+
+            line.custom_subtotal = self._get_custom_subtotal(
+                line.product_id.product_tmpl_id, line.quantity, line.price_unit, line.fob_total, rate)
+            trace.log("Subtotal personalizado de la línea %s: %s", line.id or 'nueva', line.custom_subtotal)
+            trace.count('custom')
+        trace.summary()
+
+    @api.model
+    def _get_custom_subtotal(self, product, quantity, price_unit, fob_total, rate):
+        """
+        Subtotal de una línea ``calculate_custom`` ya valorizada. ``product`` es cualquier objeto con
+        ``fob_total``, ``is_storage`` y ``min_price`` (la plantilla o un ``BillingPackProduct``).
+        """
+        # Cálculo para productos FOB
+        if product.fob_total:
+            return max((fob_total or 0) * rate * 0.001, product.min_price)
+        # Cálculo para productos de almacenamiento: el precio ya incluye los días
+        if product.is_storage:
+            return max(quantity * price_unit, product.min_price)
+        # Cálculo normal
+        return price_unit * quantity
 
     def _get_computed_price(self):
-        """Método para obtener el precio computado según el tipo de producto"""
+        """Precio unitario de la línea ``calculate_custom`` a partir de su precio base (en almacenamiento, la tarifa por m3 y por día)"""
         self.ensure_one()
         if not self.calculate_custom or not self.product_id:
             return self.price_unit
 
-        product = self.product_id
-        
         # Obtener tasa de cambio
-        usd_currency = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-        rate = 1.0
-        if usd_currency:
-            rate_data = usd_currency._get_rates(self.env.company, self.move_id.date or fields.Date.context_today(self))
-            rate = 1 / rate_data.get(usd_currency.id, 1.0)
-
-        if product.product_tmpl_id.fob_total:
-            price = self.fob_total * rate * 0.001
-            return max(price, product.product_tmpl_id.min_price)
-        elif product.product_tmpl_id.is_storage:
-            price = self.price_unit * self.days_storage
-            return max(price, product.product_tmpl_id.min_price / self.quantity if self.quantity else 0)
-        return self.price_unit
+        rate = self.env['res.currency']._get_usd_rate(self.env.company, self.move_id.date or fields.Date.context_today(self))
+        return self._get_custom_price_unit(
+            self.product_id.product_tmpl_id, self.quantity, self.days_storage, self.price_unit, self.fob_total, rate)
 
     @api.model
-    def create(self, vals):
-        res = super().create(vals)
-        if res.calculate_custom:
-            price = res._get_computed_price()
-            if price != res.price_unit:
-                res.with_context(check_move_validity=False).write({'price_unit': price})
-        return res
+    def _get_custom_price_unit(self, product, quantity, days_storage, price_unit, fob_total, rate):
+        """Precio unitario de una línea ``calculate_custom`` con precio base ``price_unit`` y tasa USD ``rate``"""
+        if product.fob_total:
+            return max((fob_total or 0) * rate * 0.001, product.min_price)
+        if product.is_storage:
+            return self._get_storage_price_unit(product, quantity, days_storage, price_unit)
+        return price_unit
+
+    @api.model
+    def _get_storage_price_unit(self, product, quantity, days_storage, rate):
+        """
+        Precio por m3 del período de una línea de almacenamiento: la tarifa diaria ``rate`` por los
+        días, o el que lleva el subtotal al mínimo del producto. El motor contable calcula el
+        subtotal como cantidad * precio, así que los días entran en el precio solo aquí.
+        """
+        price_unit = (days_storage or 0) * (rate or 0.0)
+        if quantity and quantity * price_unit < product.min_price:
+            return round(product.min_price / quantity, 6)
+        return price_unit
+
+    @api.model
+    def _prepare_custom_price_vals(self, vals_list):
+        """
+        Completa ``price_unit`` con el precio personalizado de las líneas ``calculate_custom``
+        antes de crearlas (mismas reglas que ``_get_computed_price``), así se insertan ya
+        valorizadas. Productos, fechas de factura y tasas se resuelven una vez para todo el lote.
+
+        El precio FOB no depende de ningún precio base. En almacenamiento el ``price_unit`` de vals
+        es la tarifa por m3 y por día; sin él, la línea toma la tarifa de lista al crearse y la
+        valoriza ``_compute_price_unit``.
+        """
+        custom = [vals for vals in vals_list if vals.get('calculate_custom') and vals.get('product_id')]
+        if not custom:
+            return
+        products = self.env['product.product'].browse({vals['product_id'] for vals in custom})
+        products.mapped('product_tmpl_id')  # lectura en lote de las plantillas
+        move_dates = {
+            move.id: move.date
+            for move in self.env['account.move'].browse({vals['move_id'] for vals in custom if vals.get('move_id')})
+        }
+        today = fields.Date.context_today(self)
+        currency_obj = self.env['res.currency']
+
+        for vals in custom:
+            template = products.browse(vals['product_id']).product_tmpl_id
+            if template.fob_total:
+                rate = currency_obj._get_usd_rate(self.env.company, move_dates.get(vals.get('move_id')) or today)
+                vals['price_unit'] = max((vals.get('fob_total') or 0) * rate * 0.001, template.min_price)
+            elif template.is_storage and 'price_unit' in vals:
+                vals['price_unit'] = self._get_storage_price_unit(
+                    template, vals.get('quantity', 1.0), vals.get('days_storage'), vals['price_unit'] or 0.0)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        vals_list = [dict(vals) for vals in vals_list]
+        self._prepare_custom_price_vals(vals_list)
+        lines = super().create(vals_list)
+        lines.move_id._mark_task_relations_dirty()
+        return lines
 
     def write(self, vals):
+        relation_changed = any(field in vals for field in TASK_RELATION_FIELDS)
+        if relation_changed:
+            # La factura anterior también pierde la tarea si la línea cambia de factura
+            self.move_id._mark_task_relations_dirty()
         res = super().write(vals)
-        if any(field in vals for field in ['calculate_custom', 'quantity', 'price_unit', 'days_storage']):
+        if relation_changed:
+            self.move_id._mark_task_relations_dirty()
+        if 'price_unit' in vals:
+            # El precio escrito es el precio base; los cambios de cantidad, días o FOB los recalcula _compute_price_unit
             for line in self:
                 if line.calculate_custom:
                     price = line._get_computed_price()
                     if price != line.price_unit:
                         super(AccountMoveLineInherit, line.with_context(check_move_validity=False)).write({'price_unit': price})
-        return res
\ No newline at end of file
+        return res
+
+    def unlink(self):
+        self.move_id._mark_task_relations_dirty()
+        return super().unlink()
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Recorrido por lotes de tablas completas (facturas, tareas) con memoria acotada."""
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def iter_record_chunks(model, domain=None, chunk_size=DEFAULT_CHUNK_SIZE, start_after=0):
+    """Recorre los registros de ``domain`` en lotes ordenados por id.
+
+    Cada lote se busca con paginación por clave (``id > último id``), así que el costo de la
+    búsqueda no crece con el avance y los registros creados o borrados durante el recorrido
+    no desplazan a los demás. Al terminar cada lote se vacía la caché del entorno (guardando
+    antes los cambios pendientes), de modo que la memoria no depende del tamaño de la tabla.
+
+    :param model: modelo (recordset vacío) a recorrer, con el entorno a usar
+    :param domain: dominio de búsqueda; por defecto todos los registros
+    :param chunk_size: cantidad de registros por lote
+    :param start_after: id a partir del cual se reanuda el recorrido (excluido)
+    :return: generador de recordsets, uno por lote
+    """
+    domain = list(domain or [])
+    last_id = start_after or 0
+    while True:
+        ids = model.search(domain + [('id', '>', last_id)], order='id', limit=chunk_size).ids
+        if not ids:
+            return
+        last_id = ids[-1]
+        yield model.browse(ids)
+        model.env.invalidate_all()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Presupuesto de tiempo y de registros para los crons que trabajan por lotes y se reprograman solos."""
+import logging
+import time
+
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# Segundos por ejecución (ir.config_parameter); 0 desactiva el límite de tiempo
+CRON_TIME_BUDGET_PARAM = 'dev_invoice.cron_time_budget'
+# Registros por ejecución (ir.config_parameter); 0 desactiva el límite de registros
+CRON_RECORD_BUDGET_PARAM = 'dev_invoice.cron_record_budget'
+DEFAULT_CRON_TIME_BUDGET = 300
+DEFAULT_CRON_RECORD_BUDGET = 0
+# Fracción del límite de tiempo real de los crons que puede usar una ejecución
+CRON_TIME_LIMIT_RATIO = 0.5
+
+
+def _cron_time_limit():
+    """Límite de tiempo real de los procesos de cron en segundos (0 si no hay límite)"""
+    limit = config.get('limit_time_real_cron')
+    if limit is None or limit < 0:
+        limit = config.get('limit_time_real') or 0
+    return limit
+
+
+class CronBudget:
+    """Presupuesto de una ejecución de cron.
+
+    Quien llama procesa por lotes, confirma y guarda su punto de control después de cada lote,
+    descuenta los registros con ``consume`` y corta cuando ``exhausted`` es verdadero. Sin
+    parámetro configurado, el tiempo se limita además a una fracción de ``limit_time_real_cron``
+    para que la ejecución termine bien antes de que el proceso la corte.
+    """
+
+    def __init__(self, env, time_budget=None, record_budget=None):
+        ICP = env['ir.config_parameter'].sudo()
+        if time_budget is None:
+            configured = ICP.get_param(CRON_TIME_BUDGET_PARAM)
+            time_budget = float(configured) if configured else DEFAULT_CRON_TIME_BUDGET
+            limit = _cron_time_limit()
+            if not configured and limit:
+                time_budget = min(time_budget, limit * CRON_TIME_LIMIT_RATIO)
+        if record_budget is None:
+            record_budget = int(ICP.get_param(CRON_RECORD_BUDGET_PARAM, DEFAULT_CRON_RECORD_BUDGET))
+        self.time_budget = time_budget
+        self.record_budget = record_budget
+        self.start = time.monotonic()
+        self.records = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def consume(self, count):
+        self.records += count
+
+    @property
+    def exhausted(self):
+        if self.time_budget and self.elapsed >= self.time_budget:
+            return True
+        return bool(self.record_budget and self.records >= self.record_budget)
+
+
+def trigger_cron(env, xmlid):
+    """Programa una nueva ejecución inmediata del cron para continuar con el trabajo pendiente"""
+    cron = env.ref(xmlid, raise_if_not_found=False)
+    if cron:
+        cron.sudo()._trigger()
+        _logger.info("Cron %s reprogramado para continuar con el trabajo pendiente", xmlid)
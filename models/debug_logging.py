@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import Counter
+
+from odoo import models
+
+_logger = logging.getLogger(__name__)
+
+# Modelos (separados por coma, o '*') con el log de depuración de facturación activado
+DEBUG_MODELS_PARAM = 'dev_invoice.debug_models'
+# Clave de contexto que activa el log de depuración para cualquier modelo
+DEBUG_CONTEXT_KEY = 'dev_invoice_debug'
+# A partir de esta cantidad de registros se emite solo un resumen en lugar de un mensaje por registro
+BULK_LOG_THRESHOLD = 20
+
+
+class DebugTrace:
+    """Log de depuración de un cálculo sobre un conjunto de registros.
+
+    Los mensajes usan formato ``%`` diferido; quien llama debe consultar ``verbose`` antes de
+    preparar argumentos costosos (display_name, búsquedas). En lotes grandes solo se cuentan
+    los eventos y ``summary()`` emite una única línea.
+    """
+
+    def __init__(self, logger, level, label, bulk):
+        self.logger = logger
+        self.level = level
+        self.label = label
+        self.enabled = level is not None
+        self.verbose = self.enabled and not bulk
+        self.counts = Counter()
+
+    def log(self, msg, *args):
+        if self.verbose:
+            self.logger.log(self.level, "[%s] " + msg, self.label, *args)
+
+    def count(self, key, value=1):
+        if self.enabled:
+            self.counts[key] += value
+
+    def summary(self):
+        if self.enabled and self.counts:
+            self.logger.log(
+                self.level, "[%s] resumen: %s", self.label,
+                ', '.join('%s=%s' % item for item in sorted(self.counts.items())),
+            )
+
+
+class DevInvoiceDebugMixin(models.AbstractModel):
+    _name = 'dev.invoice.debug.mixin'
+    _description = 'Log de depuración de facturación'
+
+    def _debug_logger(self):
+        return logging.getLogger('%s.%s' % (__name__, self._name))
+
+    def _debug_level(self):
+        """Nivel del log de depuración del modelo, o None si no hay que emitir nada.
+
+        Activado por contexto o parámetro del sistema se emite en INFO; si no, solo en DEBUG
+        cuando el logger del modelo tiene ese nivel habilitado.
+        """
+        logger = self._debug_logger()
+        if self._debug_switched_on():
+            return logging.INFO if logger.isEnabledFor(logging.INFO) else None
+        return logging.DEBUG if logger.isEnabledFor(logging.DEBUG) else None
+
+    def _debug_switched_on(self):
+        if self.env.context.get(DEBUG_CONTEXT_KEY):
+            return True
+        param = self.env['ir.config_parameter'].sudo().get_param(DEBUG_MODELS_PARAM)
+        if not param:
+            return False
+        models_on = {name.strip() for name in param.split(',')}
+        return '*' in models_on or self._name in models_on
+
+    def _debug_trace(self, label):
+        return DebugTrace(self._debug_logger(), self._debug_level(), label, bulk=len(self) > BULK_LOG_THRESHOLD)
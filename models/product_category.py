@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class ProductCategory(models.Model):
+    _inherit = 'product.category'
+
+    def write(self, vals):
+        res = super().write(vals)
+        # La cuenta de ingresos forma parte de la caché de paquetes de facturación
+        if 'property_account_income_categ_id' in vals:
+            self.clear_caches()
+        return res
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+# Campos de product.product cuyo cambio invalida la caché de paquetes de facturación
+BILLING_PACK_VARIANT_FIELDS = {
+    'active', 'product_tmpl_id', 'product_template_attribute_value_ids', 'price_extra', 'lst_price', 'company_id',
+}
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        if records.product_tmpl_id._has_billing_pack():
+            self.clear_caches()
+        return records
+
+    def write(self, vals):
+        if not BILLING_PACK_VARIANT_FIELDS.intersection(vals):
+            return super().write(vals)
+        templates = self.with_context(active_test=False).product_tmpl_id
+        res = super().write(vals)
+        if (templates | self.with_context(active_test=False).product_tmpl_id)._has_billing_pack():
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        clear = self.with_context(active_test=False).product_tmpl_id._has_billing_pack()
+        res = super().unlink()
+        if clear:
+            self.clear_caches()
+        return res
@@ -1,10 +1,35 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api, _
+from collections import namedtuple
+
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import UserError, ValidationError
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Datos de un producto de paquete de facturación guardados en la caché del registro
+BillingPackProduct = namedtuple('BillingPackProduct', [
+    'id', 'lst_price', 'min_price', 'fob_total', 'is_storage', 'one_line_invoice', 'account_id',
+])
+
+# Filtros IMO/General usados por los distintos generadores de facturas
+IMO_FILTER_DOMAINS = {
+    None: [],
+    'imo': ['|', ('product_tmpl_id.is_imo', '=', True), ('product_tmpl_id.is_general', '=', True)],
+    'non_imo': ['|', ('product_tmpl_id.is_imo', '=', False), ('product_tmpl_id.is_general', '=', True)],
+    'imo_only': [('product_tmpl_id.is_imo', '=', True)],
+    'non_imo_only': [('product_tmpl_id.is_imo', '=', False)],
+}
+
+# Indicadores que hacen de una plantilla un producto de paquete de facturación
+BILLING_PACK_FLAGS = ('income_invoice_pack', 'outcome_invoice_pack', 'stock_invoice_pack', 'product_full_transit')
+
+# Campos de product.template cuyo cambio invalida la caché de paquetes de facturación
+BILLING_PACK_FIELDS = set(BILLING_PACK_FLAGS) | {
+    'fob_total', 'is_storage', 'one_line_invoice', 'min_price', 'is_imo', 'is_general',
+    'list_price', 'categ_id', 'active', 'company_id',
+}
+
 
 class ProductTemplate(models.Model):
     _inherit = 'product.template'
@@ -25,4 +50,66 @@ class ProductTemplate(models.Model):
 
     is_imo = fields.Boolean(string='Utilizar para facturación IMO')
 
-    is_general = fields.Boolean(string='Utilizar para facturación General e IMO')
\ No newline at end of file
+    is_general = fields.Boolean(string='Utilizar para facturación General e IMO')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        # Solo las plantillas de paquetes entran en la caché: los demás productos no la invalidan
+        if any(vals.get(flag) for vals in vals_list for flag in BILLING_PACK_FLAGS):
+            self.clear_caches()
+        return records
+
+    def write(self, vals):
+        if not BILLING_PACK_FIELDS.intersection(vals):
+            return super().write(vals)
+        # La plantilla puede ser de paquete antes del cambio (deja de serlo) o después (pasa a serlo)
+        was_pack = self._has_billing_pack()
+        res = super().write(vals)
+        if was_pack or self._has_billing_pack():
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        clear = self._has_billing_pack()
+        res = super().unlink()
+        if clear:
+            self.clear_caches()
+        return res
+
+    def _has_billing_pack(self):
+        """Indica si alguna de las plantillas es un producto de paquete de facturación (incluidas las archivadas)"""
+        return any(tmpl[flag] for tmpl in self.with_context(active_test=False) for flag in BILLING_PACK_FLAGS)
+
+    @api.model
+    def _get_billing_pack_products(self, pack_field, imo_filter=None, company=None):
+        """Devuelve los pares (product.product, BillingPackProduct) del paquete ``pack_field``.
+
+        ``imo_filter`` es una clave de IMO_FILTER_DOMAINS. Los datos salen de la caché del registro,
+        por lo que la generación de facturas no vuelve a consultar el catálogo.
+        """
+        company = company or self.env.company
+        entries = self._get_billing_pack_data(pack_field, imo_filter, company.id)
+        products = self.env['product.product'].browse([entry.id for entry in entries])
+        return list(zip(products, entries))
+
+    @api.model
+    @tools.ormcache('pack_field', 'imo_filter', 'company_id')
+    def _get_billing_pack_data(self, pack_field, imo_filter, company_id):
+        domain = [
+            ('product_tmpl_id.' + pack_field, '=', True),
+            ('company_id', 'in', [False, company_id]),
+        ] + IMO_FILTER_DOMAINS[imo_filter]
+        products = self.env['product.product'].sudo().with_company(company_id).search(domain)
+        return tuple(
+            BillingPackProduct(
+                id=product.id,
+                lst_price=product.lst_price,
+                min_price=product.min_price,
+                fob_total=product.fob_total,
+                is_storage=product.is_storage,
+                one_line_invoice=product.one_line_invoice,
+                account_id=product.categ_id.property_account_income_categ_id.id,
+            )
+            for product in products
+        )
@@ -1,15 +1,34 @@
 # -*- coding: utf-8 -*-
 import logging
+from collections import defaultdict
 
-from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
 from datetime import timedelta
 
+from .batch_iteration import iter_record_chunks
+from .cron_budget import CronBudget, trigger_cron
+
 _logger = logging.getLogger(__name__)
 
+# Facturas creadas por cada llamada a ``create`` en la facturación por lotes
+STORAGE_INVOICE_BATCH_SIZE = 100
+# Corrida de almacenamiento en curso cuando una ejecución del cron se corta por presupuesto (ir.config_parameter)
+STORAGE_BILLING_RUN_PARAM = 'dev_invoice.storage_billing_run'
+# Punto de control (último id de tarea) de la actualización de días de almacenamiento (ir.config_parameter)
+DAYS_STORAGE_CURSOR_PARAM = 'dev_invoice.days_storage_cursor'
+# Espacio de los bloqueos consultivos de facturación: (período AAAAMM, id de tarea)
+BILLING_LOCK_NAMESPACE = 'dev_invoice.billing'
+# Tareas procesadas por lote en la actualización diaria de días de almacenamiento
+DAYS_STORAGE_CHUNK_SIZE = 1000
+# Claves en cr.precommit.data con los nombres de lote y las tareas cuyo stock disponible queda por refrescar
+PENDING_LOT_NAMES_KEY = 'dev_invoice.pending_lot_names'
+PENDING_LOT_TASKS_KEY = 'dev_invoice.pending_lot_tasks'
+
 
 class ProjectTask(models.Model):
-    _inherit = 'project.task'
+    _name = 'project.task'
+    _inherit = ['project.task', 'dev.invoice.debug.mixin']
 
     transit_total_cost = fields.Float(
         string='Costo total del transito',
@@ -19,64 +38,209 @@ class ProjectTask(models.Model):
     )
 
     date_next_billing = fields.Date(string="Fecha de proxima facturación mensual", help="Corresponde a la fecha en la cual desea que se realice la facturación mensual, la misma aumentara en dias")
+    billable_importation = fields.Boolean(string="Importación facturable", compute="_compute_billable_importation", store=True, index=True,
+                                          help="Tarea de un proyecto de importación sin egreso completo: entra en la facturación de almacenamiento.")
     
     days_invoiced = fields.Integer(string="Días de Almacenamiento Facturado", compute="_compute_days_storage_invoiced", store=True, help="Días de almacenamiento facturados en las líneas de factura.", tracking=True)
 
     days_to_invoiced = fields.Integer(string="Días de Almacenamiento a Facturar", compute="_compute_days_storage_to_invoiced", store=True, help="Días de almacenamiento a facturar.")
 
     full_transit = fields.Boolean(string="Tránsito Completo", help="Indica si el tránsito está completo y listo para facturar.", store=True)
+    # Mantenido por _refresh_lot_available_qty desde los cambios de stock.quant, stock.lot y del nombre de la tarea
+    lot_available_qty = fields.Float(string="Stock disponible del lote", readonly=True, copy=False,
+                                     help="Cantidad positiva en stock de los lotes con el mismo nombre que la tarea.")
+
+    billing_summary_ids = fields.One2many('project.task.billing.summary', 'task_id', string="Resumen de facturación", readonly=True)
+    last_storage_period = fields.Date(string="Último período de almacenamiento facturado", compute="_compute_last_storage_period")
 
     move_lines_ids = fields.Many2many('account.move.line', compute="_compute_move_line_ids", string="Líneas de Factura", help="Líneas de factura asociadas a esta tarea.", store=False)
 
 
     @api.depends('name', 'invoice_ids_filtered')
     def _compute_move_line_ids(self):
+        # Una sola búsqueda para todas las tareas, agrupando las líneas en memoria
+        task_ids = [tid for tid in self._origin.ids if tid]
+        lines_by_task = defaultdict(list)
+        if task_ids:
+            move_lines = self.env['account.move.line'].search([('task_id', 'in', task_ids)])
+            for line in move_lines:
+                lines_by_task[line.task_id.id].append(line.id)
+        for task in self:
+            task.move_lines_ids = [(6, 0, lines_by_task.get(task._origin.id, []))]
+
+    @api.depends('egreso_completo', 'project_id.importation')
+    def _compute_billable_importation(self):
         for task in self:
-            move_lines = self.env['account.move.line'].search([
-                ('task_id', '=', task.id),  # Filtra por el id de la tarea
-            ])
-            task.move_lines_ids = move_lines
+            task.billable_importation = bool(task.project_id.importation and not task.egreso_completo)
+
+    def init(self):
+        # Búsqueda exacta por nombre entre tareas y lotes (los índices estándar de name son trigram)
+        tools.create_index(self.env.cr, 'project_task_name_btree_index', self._table, ['name'])
+        tools.create_index(self.env.cr, 'stock_lot_name_btree_index', 'stock_lot', ['name'])
+        # Cola de facturación de almacenamiento: solo las tareas abiertas, por fecha de próxima facturación
+        tools.create_index(self.env.cr, 'project_task_storage_due_index', self._table,
+                           ['date_next_billing NULLS FIRST', 'id'], where='billable_importation')
+        self._refresh_lot_available_qty()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        tasks = super().create(vals_list)
+        tasks._mark_lot_availability_dirty()
+        return tasks
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'name' in vals:
+            self._mark_lot_availability_dirty()
+        return res
+
+    def _mark_lot_availability_dirty(self, lot_names=()):
+        """Anota tareas (o nombres de lote) cuyo stock disponible se refresca una vez antes del commit"""
+        task_ids = [task_id for task_id in self.ids if task_id]
+        lot_names = [name for name in lot_names if name]
+        if not task_ids and not lot_names:
+            return
+        data = self.env.cr.precommit.data
+        if PENDING_LOT_NAMES_KEY not in data and PENDING_LOT_TASKS_KEY not in data:
+            self.env.cr.precommit.add(self.env['project.task'].sudo()._flush_pending_lot_availability)
+        data.setdefault(PENDING_LOT_TASKS_KEY, set()).update(task_ids)
+        data.setdefault(PENDING_LOT_NAMES_KEY, set()).update(lot_names)
+
+    @api.model
+    def _flush_pending_lot_availability(self):
+        """Aplica los refrescos pendientes; llamarlo antes de leer lot_available_qty en la misma transacción"""
+        data = self.env.cr.precommit.data
+        task_ids = data.pop(PENDING_LOT_TASKS_KEY, None)
+        lot_names = data.pop(PENDING_LOT_NAMES_KEY, None)
+        if task_ids or lot_names:
+            self._refresh_lot_available_qty(lot_names=lot_names or (), task_ids=task_ids or ())
+
+    @api.model
+    def _refresh_lot_available_qty(self, lot_names=None, task_ids=None):
+        """
+        Recalcula en SQL el stock disponible de las tareas con esos nombres de lote o ids
+        (sin argumentos, de todas) y escribe solo las que cambian.
+        """
+        conditions = []
+        params = []
+        if lot_names:
+            conditions.append("task.name IN %s")
+            params.append(tuple(lot_names))
+        if task_ids:
+            conditions.append("task.id IN %s")
+            params.append(tuple(task_ids))
+        if not conditions and (lot_names is not None or task_ids is not None):
+            return self.browse()
+
+        self.env['stock.quant'].flush_model(['lot_id', 'quantity'])
+        self.env['stock.lot'].flush_model(['name'])
+        self.flush_model(['name'])
+        self.env.cr.execute(f"""
+            UPDATE project_task task
+               SET lot_available_qty = stock.qty
+              FROM (
+                    SELECT task.id, COALESCE(SUM(quant.quantity), 0) AS qty
+                      FROM project_task task
+                 LEFT JOIN stock_lot lot ON lot.name = task.name
+                 LEFT JOIN stock_quant quant ON quant.lot_id = lot.id AND quant.quantity > 0
+                     WHERE {' OR '.join(conditions) or 'TRUE'}
+                  GROUP BY task.id
+                   ) stock
+             WHERE task.id = stock.id
+               AND task.lot_available_qty IS DISTINCT FROM stock.qty
+         RETURNING task.id
+        """, params)
+        tasks = self.browse([row[0] for row in self.env.cr.fetchall()])
+        tasks.invalidate_recordset(['lot_available_qty'])
+        return tasks
 
     def costo_total_transito(self):
-        for rec in self:
-            rec._compute_transit_total_cost()
+        self._compute_transit_total_cost()
 
-    @api.depends('move_lines_ids')
+    def _get_billing_summaries(self):
+        """{id de tarea: resumen de facturación} de las tareas, leídos en una sola búsqueda"""
+        task_ids = [tid for tid in self._origin.ids if tid]
+        if not task_ids:
+            return {}
+        summaries = self.env['project.task.billing.summary'].sudo().search([('task_id', 'in', task_ids)])
+        return {summary.task_id.id: summary for summary in summaries}
+
+    @api.depends('billing_summary_ids.amount_billed')
     def _compute_transit_total_cost(self):
+        # Facturas y notas de crédito publicadas, acumuladas en el resumen de facturación
+        # (para notas de crédito el amount es negativo, se resta automáticamente)
+        summaries = self._get_billing_summaries()
         for rec in self:
-            _logger.info(f"Calculando costo total de tránsito para tarea: {rec.id}")
-            
-            # Búsqueda optimizada: incluimos facturas y notas de crédito
-            moves = self.env['account.move'].search([
-                ('task_id', 'in', [rec.id]),
-                ('move_type', 'in', ['out_invoice', 'out_refund']),  # Facturas y notas de crédito
-                ('state', 'not in', ['draft', 'cancel'])
-            ])
-            
-            if moves:
-                # Para notas de crédito el amount es negativo, se suma automáticamente
-                rec.transit_total_cost = sum(moves.mapped('amount_untaxed_signed'))
-                _logger.info(
-                    f"Tarea: {rec.id} | "
-                    f"Documentos encontrados: {len(moves)} | "
-                    f"Total: {rec.transit_total_cost} | "
-                    f"IDs: {moves.ids}"
-                )
-            else:
-                rec.transit_total_cost = 0.0
-                _logger.info(f"Tarea: {rec.id} | No se encontraron documentos relacionados")
-    
-    @api.depends('move_lines_ids.days_storage', 'move_lines_ids.move_id.state', 'days_storage')
+            summary = summaries.get(rec._origin.id)
+            rec.transit_total_cost = summary.amount_billed if summary else 0.0
+        trace = self._debug_trace('_compute_transit_total_cost')
+        trace.count('tareas', len(self))
+        trace.count('con_documentos', len(summaries))
+        trace.summary()
+
+    @api.depends('billing_summary_ids.days_billed', 'days_storage')
     def _compute_days_storage_invoiced(self):
+        summaries = self._get_billing_summaries()
         for task in self:
-            posted_lines = task.move_lines_ids.filtered(lambda line: line.move_id.state == 'posted')
-            task.days_invoiced = sum(posted_lines.mapped('days_storage') or [0])
+            summary = summaries.get(task._origin.id)
+            task.days_invoiced = summary.days_billed if summary else 0
+
+    @api.depends('billing_summary_ids.last_storage_period')
+    def _compute_last_storage_period(self):
+        summaries = self._get_billing_summaries()
+        for task in self:
+            summary = summaries.get(task._origin.id)
+            task.last_storage_period = summary.last_storage_period if summary else False
 
     @api.depends('days_storage', 'days_invoiced')
     def _compute_days_storage_to_invoiced(self):
         for task in self:
             task.days_to_invoiced = max(0, (task.days_storage or 0) - (task.days_invoiced or 0))
 
+    @api.model
+    def _cron_update_days_storage(self, chunk_size=DAYS_STORAGE_CHUNK_SIZE, time_budget=None, record_budget=None):
+        """Refresca los días de almacenamiento de las tareas de importación abiertas.
+
+        Recorre las tareas por lotes ordenados por id y solo escribe las que cambian. Cada lote
+        se confirma junto con su punto de control; al agotar el presupuesto (``CronBudget``) la
+        ejecución termina y vuelve a programar el cron, que sigue desde la tarea siguiente.
+        """
+        budget = CronBudget(self.env, time_budget, record_budget)
+        ICP = self.env['ir.config_parameter'].sudo()
+        domain = [('billable_importation', '=', True)]
+        tracked = ['days_storage', 'days_invoiced', 'days_to_invoiced']
+        scanned = updated = 0
+        start_after = int(ICP.get_param(DAYS_STORAGE_CURSOR_PARAM, 0))
+
+        for tasks in iter_record_chunks(self, domain, chunk_size, start_after):
+            before = {task['id']: task for task in tasks.read(tracked, load=False)}
+            # Los cálculos corren sobre copias en memoria: las tareas sin cambios no se escriben
+            # (ni cambian write_date ni generan seguimiento)
+            snapshot = self.concat(*[task.new(origin=task) for task in tasks])
+            changes = defaultdict(lambda: self.browse())
+            for task in snapshot:
+                origin = before[task._origin.id]
+                diff = tuple((fname, task[fname]) for fname in tracked if task[fname] != origin[fname])
+                if diff:
+                    changes[diff] |= task._origin
+            # Una escritura por combinación de valores nuevos
+            for diff, changed in changes.items():
+                changed.write(dict(diff))
+                updated += len(changed)
+            scanned += len(tasks)
+            ICP.set_param(DAYS_STORAGE_CURSOR_PARAM, tasks[-1].id)
+            budget.consume(len(tasks))
+            self.env.cr.commit()  # Commit por lote junto con el punto de control
+            if budget.exhausted:
+                trigger_cron(self.env, 'dev_invoice.cron_update_days_storage')
+                _logger.info("Días de almacenamiento actualizados: %s de %s tareas revisadas; continúa desde la tarea %s",
+                             updated, scanned, tasks[-1].id)
+                return True
+
+        ICP.set_param(DAYS_STORAGE_CURSOR_PARAM, False)
+        _logger.info("Días de almacenamiento actualizados: %s de %s tareas abiertas", updated, scanned)
+        return True
+
     def action_open_days_invoiced_wizard(self):
         return {
             'type': 'ir.actions.act_window',
@@ -100,7 +264,7 @@ class ProjectTask(models.Model):
 
     def _create_invoice(self, product_pack_field):
         account_move_obj = self.env['account.move']
-        account_move_line_obj = self.env['account.move.line']
+        trace = self._debug_trace('_create_invoice')
 
         for task in self:
             # Validación de egreso_completo
@@ -112,19 +276,8 @@ class ProjectTask(models.Model):
                 raise ValidationError(f"La tarea {task.name} no tiene definida la fecha de ingreso.")
 
             # Buscar productos asociados al campo específico
-            domain = [('product_tmpl_id.' + product_pack_field, '=', True)]
-            if task.is_imo:
-                domain.extend(['|', 
-                    ('product_tmpl_id.is_imo', '=', True),
-                    ('product_tmpl_id.is_general', '=', True)
-                ])
-            else:
-                domain.extend(['|',
-                    ('product_tmpl_id.is_imo', '=', False),
-                    ('product_tmpl_id.is_general', '=', True)
-                ])
-
-            products = self.env['product.product'].search(domain)
+            products = self.env['product.template']._get_billing_pack_products(
+                product_pack_field, 'imo' if task.is_imo else 'non_imo')
             if not products:
                 raise ValidationError('No hay productos configurados con el paquete solicitado.')
 
@@ -155,49 +308,36 @@ class ProjectTask(models.Model):
             else:
                 narration = ""
 
-            # Crear la factura
-            invoice = account_move_obj.create({
-                'partner_id': task.partner_id.id,
-                'move_type': 'out_invoice',  # Factura de cliente
-                'invoice_origin': task.name,
-                'invoice_date': fields.Date.today(),  # Fecha de la factura
-                'narration': narration,  # Agregar la narración
-            })
-            _logger.info(f"Factura creada con ID: {invoice.id} para la tarea {task.name} (ID: {task.id})")
+            invoice_date = fields.Date.today()
 
             # Obtener la tasa de cambio de USD
-            usd_currency = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-            if not usd_currency:
-                raise ValidationError("No se encontró la divisa USD en el sistema.")
-
-            rate = usd_currency.rate  # Tasa de cambio actual de USD
-            _logger.info(f"Tasa de cambio USD: {rate}")
-
-            if not task.fecha_ingreso:
-                raise ValidationError(f"La tarea {task.name} no tiene definida la fecha de ingreso.")
+            # Tasa de cambio actual de USD (dólares por unidad de moneda de la compañía)
+            rate = 1 / self.env['res.currency']._get_usd_rate(raise_if_missing=True)
+            trace.log("Tasa de cambio USD: %s", rate)
 
             # Validar si la fecha de la factura está en el mismo mes que la fecha_ingreso
-            factura_mes = invoice.invoice_date.month
-            factura_anio = invoice.invoice_date.year
+            factura_mes = invoice_date.month
+            factura_anio = invoice_date.year
             ingreso_mes = task.fecha_ingreso.month
             ingreso_anio = task.fecha_ingreso.year
 
-            # Agregar líneas de factura
-            for product in products:
+            # Armar las líneas de factura
+            line_vals_list = []
+            for product, pack in products:
                 # Verificar si el product.template tiene fob_total como True
-                if product.product_tmpl_id.fob_total:
+                if pack.fob_total:
                     if factura_mes != ingreso_mes and factura_anio != ingreso_anio:
-                        _logger.info(f"Producto {product.name} omitido porque la fecha de factura está en distinto mes que la fecha de ingreso.")
+                        trace.log("Producto %s omitido porque la fecha de factura está en distinto mes que la fecha de ingreso.", product.name)
                         continue  # Saltar este producto
                     elif factura_anio == ingreso_anio and factura_mes == ingreso_mes:
                         # Calcular el quantity como total_fob * rate * 0.001 si el mes/año de la factura es posterior
                         quantity = task.total_fob * rate * 0.001
                         calculate_custom = True
                         product_name = f"{task.name} - Fob total:{task.total_fob} - USD:{rate}"
-                        _logger.info(f"Tipo de cambio {rate} - Total FOB {task.total_fob}")
+                        trace.log("Tipo de cambio %s - Total FOB %s", rate, task.total_fob)
                     else:
                         # Si el mes/año de la factura es anterior, no agregar el producto
-                        _logger.info(f"Producto {product.name} omitido porque la fecha de factura es anterior a la fecha de ingreso.")
+                        trace.log("Producto %s omitido porque la fecha de factura es anterior a la fecha de ingreso.", product.name)
                         continue
                 else:
                     # Para productos sin fob_total, usar valores predeterminados
@@ -205,22 +345,26 @@ class ProjectTask(models.Model):
                     calculate_custom = False
                     product_name = product.name
 
-                line = account_move_line_obj.create({
-                    'move_id': invoice.id,
+                line_vals_list.append({
                     'product_id': product.id,
                     'quantity': quantity,
                     'calculate_custom': calculate_custom,
-                    'price_unit': product.lst_price,
+                    'price_unit': pack.lst_price,
                     'name': product_name,
-                    'account_id': product.categ_id.property_account_income_categ_id.id,
+                    'account_id': pack.account_id,
                     'task_id': task.id,  # Relación con la tarea
                 })
-                _logger.info(f"Línea de factura creada con ID: {line.id}, relacionada con la tarea {task.name} (ID: {task.id})")
-            
-            try:
-                invoice.button_update_prices_from_pricelist()
-            except Exception as e:
-                _logger.error(f"Error al actualizar precios para la factura {invoice.id}: {str(e)}")
+
+            # Crear la factura con sus líneas en un solo paso
+            invoice = account_move_obj._assemble_invoices([{
+                'partner_id': task.partner_id.id,
+                'move_type': 'out_invoice',  # Factura de cliente
+                'invoice_origin': task.name,
+                'invoice_date': invoice_date,  # Fecha de la factura
+                'narration': narration,  # Agregar la narración
+                'invoice_line_ids': [(0, 0, line_vals) for line_vals in line_vals_list],
+            }])
+            trace.log("Factura creada con ID: %s para la tarea %s (ID: %s) con %s líneas", invoice.id, task.name, task.id, len(line_vals_list))
 
             # Abrir la factura recién creada
             return {
@@ -242,161 +386,13 @@ class ProjectTask(models.Model):
 
     def action_create_storage_invoice(self):
         account_move_obj = self.env['account.move']
-        account_move_line_obj = self.env['account.move.line']
+        trace = self._debug_trace('action_create_storage_invoice')
 
         for task in self:
-            # Validación de egreso_completo
-            if task.egreso_completo:
-                raise ValidationError(f"Este tránsito no se puede facturar porque está en 'Egreso Completo'. (Tarea: {task.name})")
-
-            # Buscar productos con el paquete de facturación de almacenamiento
-            domain = [('stock_invoice_pack', '=', True)]
-            if task.is_imo:
-                domain.extend(['|',
-                    ('product_tmpl_id.is_imo', '=', True),
-                    ('product_tmpl_id.is_general', '=', True)
-                ])
-            else:
-                domain.extend(['|',
-                    ('product_tmpl_id.is_imo', '=', False),
-                    ('product_tmpl_id.is_general', '=', True)
-                ])
+            # Crear la factura (account.move) con sus líneas en un solo paso
+            invoice = account_move_obj._assemble_invoices([task._prepare_storage_invoice_vals()])
 
-            products = self.env['product.product'].search(domain)
-            if not products:
-                raise ValidationError('No hay productos configurados para facturación de almacenamiento.')
-
-            # Calcular el mes y año de la factura
-            invoice_date = fields.Date.today()
-            mes_factura = invoice_date.strftime('%B').capitalize()  # Nombre del mes en español
-            anio_factura = invoice_date.strftime('%Y')
-
-            # Calcular el periodo facturado
-            inicio_periodo = invoice_date.replace(day=1).strftime('%d/%m/%Y')
-            fin_periodo = (invoice_date.replace(day=1).replace(month=invoice_date.month % 12 + 1) - timedelta(days=1)).strftime('%d/%m/%Y')
-
-            # Preparar el contenido del campo narration
-            narration = (
-                "NOTA DE MENSUAL<br/>"
-                f"CORRESPONDE AL ALMACENAJE MENSUAL {mes_factura.upper()} {anio_factura}<br/>"
-                f"Periodo Facturado: {inicio_periodo} al {fin_periodo}<br/><br/>"
-                "Banco Santander<br/>"
-                "CBU: 0720429020000000055554<br/>"
-                "Banco Credicoop<br/>"
-                "CBU: 1910246555024600234278<br/><br/>"
-                "BAJA EN IIBB CABA - BS AS DESDE 31/08/2024"
-            )
-
-            # Crear la factura (account.move)
-            invoice = account_move_obj.create({
-                'partner_id': task.partner_id.id,
-                'move_type': 'out_invoice',
-                'invoice_origin': task.name,
-                'invoice_date': invoice_date,
-                'narration': narration,  # Agregar la narración
-            })
-
-            _logger.info(f"Factura creada con ID: {invoice.id} para la tarea {task.name} (ID: {task.id})")
-
-            # Obtener la tasa de cambio de USD
-            usd_currency = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-            if not usd_currency:
-                raise ValidationError("No se encontró la divisa USD en el sistema.")
-
-            rate = 1 / usd_currency.rate # Tasa de cambio actual de USD
-            _logger.info(f"Tasa de cambio USD: {rate}")
-
-            if not task.fecha_ingreso:
-                raise ValidationError(f"La tarea {task.name} no tiene definida la fecha de ingreso.")
-
-            # Validar si la fecha de la factura está en el mismo mes que la fecha_ingreso
-            factura_mes = invoice.invoice_date.month
-            factura_anio = invoice.invoice_date.year
-            ingreso_mes = task.fecha_ingreso.month
-            ingreso_anio = task.fecha_ingreso.year
-
-            # Obtener el total de días del mes actual
-            ultimo_dia_mes = invoice_date.replace(day=1)
-            if invoice_date.month == 12:
-                ultimo_dia_mes = ultimo_dia_mes.replace(year=invoice_date.year + 1, month=1)
-            else:
-                ultimo_dia_mes = ultimo_dia_mes.replace(month=invoice_date.month + 1)
-            days_in_month = (ultimo_dia_mes - invoice_date.replace(day=1)).days
-            
-            _logger.info(f"Días totales del mes {invoice_date.strftime('%B')}: {days_in_month}")
-
-            # Agregar líneas de factura
-            for product in products:
-                if product.product_tmpl_id.fob_total:
-                    # Si la fecha de factura es diferente al mes de ingreso, agregar el producto
-                    if factura_mes != ingreso_mes and factura_anio == ingreso_anio or factura_anio != ingreso_anio:
-                        quantity = 1
-                        fob_total = task.total_fob
-                        calculate_custom = True
-                        name = f"{task.name} - Fob total:{task.total_fob} - USD:{rate}"
-                        _logger.info(f"Agregando producto FOB - Tipo de cambio {rate} - Total FOB {task.total_fob}")
-
-                        account_move_line_obj.create({
-                            'move_id': invoice.id,
-                            'product_id': product.id,
-                            'quantity': quantity,
-                            'calculate_custom': calculate_custom,
-                            'fob_total': fob_total,
-                            'name': name,
-                            'account_id': product.categ_id.property_account_income_categ_id.id,
-                            'task_id': task.id,
-                        })
-
-                elif product.product_tmpl_id.is_storage:
-                    # Calcular el precio basado en total_m3 * days_in_month * lst_price
-                    quantity = task.total_m3
-                    subtotal = quantity * days_in_month * product.lst_price
-                    calculate_custom = True
-                    
-                    if subtotal < product.product_tmpl_id.min_price:
-                        # Ajustamos el price_unit para que al multiplicar por la cantidad dé el min_price exacto
-                        price_unit = product.product_tmpl_id.min_price / (quantity if quantity > 0 else 1)
-                        price_subtotal = product.product_tmpl_id.min_price
-                    else:
-                        price_unit = days_in_month * product.lst_price
-                        price_subtotal = subtotal
-
-                    name = f"{product.name} - {task.name} - {task.total_m3} m3 - {days_in_month} días"
-                    
-                    account_move_line_obj.create({
-                        'move_id': invoice.id,
-                        'product_id': product.id,
-                        'quantity': quantity,
-                        'days_storage': days_in_month,
-                        'calculate_custom': calculate_custom,
-                        'price_unit': price_unit,
-                        'name': name,
-                        'account_id': product.categ_id.property_account_income_categ_id.id,
-                        'task_id': task.id,
-                    })
-
-                else:
-                    # Para productos sin fob_total ni is_storage, usar el total_m3 como cantidad
-                    quantity = 1
-                    name = f"{product.name} - {task.name}"
-                    calculate_custom = False
-
-                    account_move_line_obj.create({
-                        'move_id': invoice.id,
-                        'product_id': product.id,
-                        'quantity': quantity,
-                        'calculate_custom': calculate_custom,
-                        'price_unit': product.lst_price,
-                        'name': name,
-                        'account_id': product.categ_id.property_account_income_categ_id.id,
-                        'task_id': task.id,
-                    })
-
-            try:
-                invoice.button_update_prices_from_pricelist()
-            except Exception as e:
-                _logger.error(f"Error al actualizar precios para la factura {invoice.id}: {str(e)}")
-            
+            trace.log("Factura creada con ID: %s para la tarea %s (ID: %s)", invoice.id, task.name, task.id)
             
             # Abrir la factura recién creada
             return {
@@ -408,71 +404,317 @@ class ProjectTask(models.Model):
                 'target': 'current',
             }
 
-    def _cron_generate_storage_invoices(self):
-        account_move_obj = self.env['account.move']
-        account_move_line_obj = self.env['account.move.line']
-        tasks = self.search([])  # Ajusta el dominio según sea necesario
+    def _prepare_storage_invoice_vals(self):
+        """Valores de la factura de almacenamiento mensual de la tarea, con sus líneas"""
+        self.ensure_one()
+        task = self
+        trace = self._debug_trace('_prepare_storage_invoice_vals')
 
-        for task in tasks:
-            if task.egreso_completo:
-                # Ignorar tareas con egreso_completo=True
-                continue
+        # Validación de egreso_completo
+        if task.egreso_completo:
+            raise ValidationError(f"Este tránsito no se puede facturar porque está en 'Egreso Completo'. (Tarea: {task.name})")
 
-            if not task.project_id.importation:
-                # Ignorar tareas cuyo proyecto no tiene importation=True
-                continue
+        # Buscar productos con el paquete de facturación de almacenamiento
+        products = self.env['product.template']._get_billing_pack_products(
+            'stock_invoice_pack', 'imo' if task.is_imo else 'non_imo')
+        if not products:
+            raise ValidationError('No hay productos configurados para facturación de almacenamiento.')
 
-            if task.date_next_billing and task.date_next_billing > fields.Date.today():
-                # Ignorar tareas cuya próxima fecha de facturación es mayor a la fecha actual
-                continue
+        # Calcular el mes y año de la factura
+        invoice_date = fields.Date.today()
+        mes_factura = invoice_date.strftime('%B').capitalize()  # Nombre del mes en español
+        anio_factura = invoice_date.strftime('%Y')
 
-            # Buscar productos asociados al campo específico
-            products = self.env['product.product'].search([('product_tmpl_id.outcome_invoice_pack', '=', True)])
-            if not products:
-                raise ValidationError('No hay productos configurados con el paquete solicitado.')
+        # Calcular el periodo facturado
+        inicio_periodo = invoice_date.replace(day=1).strftime('%d/%m/%Y')
+        fin_periodo = (invoice_date.replace(day=1).replace(month=invoice_date.month % 12 + 1) - timedelta(days=1)).strftime('%d/%m/%Y')
 
-            # Crear la factura
-            invoice = account_move_obj.create({
-                'partner_id': task.partner_id.id,
-                'move_type': 'out_invoice',  # Factura de cliente
-                'invoice_origin': f"Storage - {task.name}",
-            })
-            _logger.info(f"Factura creada con ID: {invoice.id} para la tarea {task.name} (ID: {task.id})")
-
-            # Agregar líneas de factura
-            for product in products:
-                line = account_move_line_obj.create({
-                    'move_id': invoice.id,
+        # Preparar el contenido del campo narration
+        narration = (
+            "NOTA DE MENSUAL<br/>"
+            f"CORRESPONDE AL ALMACENAJE MENSUAL {mes_factura.upper()} {anio_factura}<br/>"
+            f"Periodo Facturado: {inicio_periodo} al {fin_periodo}<br/><br/>"
+            "Banco Santander<br/>"
+            "CBU: 0720429020000000055554<br/>"
+            "Banco Credicoop<br/>"
+            "CBU: 1910246555024600234278<br/><br/>"
+            "BAJA EN IIBB CABA - BS AS DESDE 31/08/2024"
+        )
+
+        # Obtener la tasa de cambio de USD
+        rate = self.env['res.currency']._get_usd_rate(raise_if_missing=True)  # Tasa de cambio actual de USD
+        trace.log("Tasa de cambio USD: %s", rate)
+
+        if not task.fecha_ingreso:
+            raise ValidationError(f"La tarea {task.name} no tiene definida la fecha de ingreso.")
+
+        # Validar si la fecha de la factura está en el mismo mes que la fecha_ingreso
+        factura_mes = invoice_date.month
+        factura_anio = invoice_date.year
+        ingreso_mes = task.fecha_ingreso.month
+        ingreso_anio = task.fecha_ingreso.year
+
+        # Obtener el total de días del mes actual
+        ultimo_dia_mes = invoice_date.replace(day=1)
+        if invoice_date.month == 12:
+            ultimo_dia_mes = ultimo_dia_mes.replace(year=invoice_date.year + 1, month=1)
+        else:
+            ultimo_dia_mes = ultimo_dia_mes.replace(month=invoice_date.month + 1)
+        days_in_month = (ultimo_dia_mes - invoice_date.replace(day=1)).days
+
+        if trace.verbose:
+            trace.log("Días totales del mes %s: %s", invoice_date.strftime('%B'), days_in_month)
+
+        # Armar las líneas de factura
+        line_vals_list = []
+        for product, pack in products:
+            if pack.fob_total:
+                # Si la fecha de factura es diferente al mes de ingreso, agregar el producto
+                if factura_mes != ingreso_mes and factura_anio == ingreso_anio or factura_anio != ingreso_anio:
+                    trace.log("Agregando producto FOB - Tipo de cambio %s - Total FOB %s", rate, task.total_fob)
+                    line_vals_list.append({
+                        'product_id': product.id,
+                        'quantity': 1,
+                        'calculate_custom': True,
+                        'fob_total': task.total_fob,
+                        'name': f"{task.name} - Fob total:{task.total_fob} - USD:{rate}",
+                        'account_id': pack.account_id,
+                        'task_id': task.id,
+                    })
+
+            elif pack.is_storage:
+                # Precio por m3 y por día: la línea calcula total_m3 * days_in_month * lst_price con el mínimo
+                line_vals_list.append({
+                    'product_id': product.id,
+                    'quantity': task.total_m3,
+                    'days_storage': days_in_month,
+                    'calculate_custom': True,
+                    'price_unit': pack.lst_price,
+                    'name': f"{product.name} - {task.name} - {task.total_m3} m3 - {days_in_month} días",
+                    'account_id': pack.account_id,
+                    'task_id': task.id,
+                })
+
+            else:
+                # Para productos sin fob_total ni is_storage, usar el total_m3 como cantidad
+                line_vals_list.append({
                     'product_id': product.id,
-                    'quantity': 1,  # Ajusta según sea necesario
-                    'price_unit': product.lst_price,
+                    'quantity': 1,
+                    'calculate_custom': False,
+                    'price_unit': pack.lst_price,
                     'name': f"{product.name} - {task.name}",
-                    'account_id': product.categ_id.property_account_income_categ_id.id,
-                    'task_id': task.id,  # Relación con la tarea
+                    'account_id': pack.account_id,
+                    'task_id': task.id,
                 })
-                _logger.info(f"Línea de factura creada con ID: {line.id}, relacionada con la tarea {task.name} (ID: {task.id})")
-            
-            try:
-                invoice.button_update_prices_from_pricelist()
-            except Exception as e:
-                _logger.error(f"Error al actualizar precios para la factura {invoice.id}: {str(e)}")
 
-            # Verificar si las líneas tienen el task_id asignado
-            for line in invoice.invoice_line_ids:
-                _logger.info(f"Línea de factura {line.id} asociada a la tarea {line.task_id.id if line.task_id else 'No asignada'}")
+        return {
+            'partner_id': task.partner_id.id,
+            'move_type': 'out_invoice',
+            'invoice_origin': task.name,
+            'invoice_date': invoice_date,
+            'narration': narration,  # Agregar la narración
+            'invoice_line_ids': [(0, 0, line_vals) for line_vals in line_vals_list],
+        }
 
-        return True
+    @api.model
+    def _get_storage_billing_due_domain(self):
+        """Dominio de las tareas de importación abiertas con facturación de almacenamiento vencida"""
+        return [
+            ('billable_importation', '=', True),
+            '|',
+            ('date_next_billing', '=', False),
+            ('date_next_billing', '<=', fields.Date.today()),
+        ]
+
+    @api.model
+    def _get_billing_period(self, date=None):
+        """Período de facturación (primer día del mes) de la fecha, por defecto hoy"""
+        return (date or fields.Date.context_today(self)).replace(day=1)
+
+    def _lock_for_billing(self, period):
+        """
+        Bloquea las tareas para facturarlas en el período y devuelve las que se pudieron tomar.
+
+        Cada tarea queda con bloqueo de fila (FOR UPDATE SKIP LOCKED) y con un bloqueo consultivo
+        (período, tarea) hasta el fin de la transacción: otro proceso que esté facturando la misma
+        tarea (cron o corrida manual) hace que se omita en lugar de facturarla dos veces.
+        """
+        task_ids = [tid for tid in self.ids if tid]
+        if not task_ids:
+            return self.browse()
+        self.env.cr.execute("""
+            SELECT id FROM project_task
+             WHERE id IN %s
+          ORDER BY id
+               FOR UPDATE SKIP LOCKED
+        """, [tuple(task_ids)])
+        locked_ids = [row[0] for row in self.env.cr.fetchall()]
+        return self.browse(self._try_billing_advisory_locks(period, locked_ids))
+
+    @api.model
+    def _try_billing_advisory_locks(self, period, task_ids):
+        if not task_ids:
+            return []
+        self.env.cr.execute("""
+            SELECT id FROM unnest(%s::int[]) AS id
+             WHERE pg_try_advisory_xact_lock(hashtext(%s) # %s, id)
+          ORDER BY id
+        """, [list(task_ids), BILLING_LOCK_NAMESPACE, period.year * 100 + period.month])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _claim_storage_billing_batch(self, period, run, batch_size=STORAGE_INVOICE_BATCH_SIZE, after=0):
+        """
+        Toma el siguiente lote (ids mayores que ``after``) de tareas vencidas que ningún otro
+        proceso esté facturando, que no estén facturadas en el período por ningún tipo de
+        facturación y que no hayan fallado ya en la corrida ``run``.
+
+        Devuelve (tareas tomadas, último id revisado); el id es None cuando no quedan tareas. Las
+        páginas cuyas tareas están todas bloqueadas por otros procesos se saltean.
+        """
+        ledger = self.env['project.task.billing.run.line']
+        self.flush_model(['billable_importation', 'date_next_billing'])
+        ledger.flush_model()
+        while True:
+            query = self._where_calc(self._get_storage_billing_due_domain() + [('id', '>', after)])
+            self._apply_ir_rules(query, 'read')
+            query.add_where(f"""NOT EXISTS (
+                SELECT 1 FROM {ledger._table} line
+                 WHERE line.task_id = "project_task".id
+                   AND line.period = %s
+                   AND (line.state = 'done' OR line.run_id = %s))""", [period, run.id or 0])
+            query.order = '"project_task".id'
+            query.limit = batch_size
+            query_str, params = query.select('"project_task".id')
+            self.env.cr.execute(query_str + ' FOR UPDATE OF "project_task" SKIP LOCKED', params)
+            task_ids = [row[0] for row in self.env.cr.fetchall()]
+            if not task_ids:
+                return self.browse(), None
+            after = task_ids[-1]
+            locked_ids = self._try_billing_advisory_locks(period, task_ids)
+            if locked_ids:
+                return self.browse(locked_ids), after
+
+    def _prepare_storage_cron_invoice_vals(self, products):
+        """Valores de la factura (con sus líneas) que genera el cron de almacenamiento para la tarea"""
+        self.ensure_one()
+        return {
+            'partner_id': self.partner_id.id,
+            'move_type': 'out_invoice',  # Factura de cliente
+            'invoice_origin': f"Storage - {self.name}",
+            'invoice_line_ids': [(0, 0, {
+                'product_id': product.id,
+                'quantity': 1,
+                'price_unit': pack.lst_price,
+                'name': f"{product.name} - {self.name}",
+                'account_id': pack.account_id,
+                'task_id': self.id,  # Relación con la tarea
+            }) for product, pack in products],
+        }
+
+    def _generate_storage_invoices_batch(self, products, lines):
+        """Crea en un solo ``create`` las facturas de almacenamiento de las tareas y las registra en ``lines``"""
+        start = fields.Datetime.now()
+        invoices = self.env['account.move']._assemble_invoices([
+            task._prepare_storage_cron_invoice_vals(products) for task in self
+        ], reprice=False)
+        lines._mark_done(dict(zip(self.ids, invoices)), start)
+        return invoices
+
+    def _cron_generate_storage_invoices(self, batch_size=STORAGE_INVOICE_BATCH_SIZE, time_budget=None, record_budget=None):
+        """
+        Factura el almacenamiento de las tareas vencidas por lotes, confirmando cada lote.
+
+        Cada lote se toma con bloqueo de filas (SKIP LOCKED) y bloqueos consultivos del período,
+        así que varias ejecuciones (crons o corridas manuales) pueden vaciar la cola en paralelo
+        sin facturar dos veces la misma tarea. Cada tarea queda en el registro de la corrida:
+        un lote que falla se marca con error y se reintenta en la próxima corrida.
+
+        Al agotar el presupuesto (``CronBudget``) la ejecución termina y vuelve a programar el
+        cron, que continúa la misma corrida hasta vaciar la cola.
+        """
+        budget = CronBudget(self.env, time_budget, record_budget)
+        ICP = self.env['ir.config_parameter'].sudo()
+        period = self._get_billing_period()
+        # Corrida que dejó pendiente la ejecución anterior (si es del mismo período)
+        run = self.env['project.task.billing.run'].browse(int(ICP.get_param(STORAGE_BILLING_RUN_PARAM, 0))).exists()
+        if run.period != period:
+            run = run.browse()
+        ledger = self.env['project.task.billing.run.line']
+        products = None
+        task_count = invoice_count = failed_count = 0
+        pending = False
+        after = 0
+
+        while True:
+            if budget.exhausted:
+                pending = True
+                break
+            tasks, after = self._claim_storage_billing_batch(period, run, batch_size, after)
+            if not tasks:
+                break
+            if not run:
+                # La corrida se crea solo si hay tareas para facturar
+                run = run.create({
+                    'name': f"Facturación de almacenamiento {fields.Date.context_today(self)}",
+                    'billing_type': 'storage',
+                    'period': period,
+                })
+                ICP.set_param(STORAGE_BILLING_RUN_PARAM, run.id)
+            if products is None:
+                # Buscar productos asociados al campo específico (una sola vez por ejecución)
+                products = self.env['product.template']._get_billing_pack_products('outcome_invoice_pack')
+                if not products:
+                    raise ValidationError('No hay productos configurados con el paquete solicitado.')
+            lines = ledger._reserve(run, tasks, 'storage', period)
+            batch_start = fields.Datetime.now()
+            try:
+                with self.env.cr.savepoint():
+                    invoices = lines.task_id._generate_storage_invoices_batch(products, lines)
+                    # Precios de lista agrupados por lote: un error de precios marca el lote con error
+                    invoices._check_reprice_errors(invoices._reprice_from_pricelist())
+            except Exception as e:
+                _logger.exception("Error al facturar el almacenamiento de las tareas %s", lines.task_id.ids)
+                lines._mark_failed(str(e), batch_start)
+                failed_count += len(lines)
+            else:
+                task_count += len(lines)
+                invoice_count += len(invoices)
+            budget.consume(len(lines))
+            self.env.cr.commit()  # Commit por lote: libera los bloqueos de las tareas facturadas
+
+        if pending:
+            trigger_cron(self.env, 'dev_invoice.cron_storage_invoice')
+        else:
+            ICP.set_param(STORAGE_BILLING_RUN_PARAM, False)
+        stats = {
+            'tasks': task_count,
+            'invoices': invoice_count,
+            'failed_tasks': failed_count,
+            'pending': pending,
+            'elapsed': round(budget.elapsed, 3),
+        }
+        _logger.info(
+            "Facturación de almacenamiento: %s tareas vencidas, %s facturas creadas (%s tareas con error) en %ss%s",
+            stats['tasks'], stats['invoices'], stats['failed_tasks'], stats['elapsed'],
+            " (continúa en la próxima ejecución)" if pending else "",
+        )
+        return stats
 
     def _create_single_task_invoice(self, task):
-        account_move_obj = self.env['account.move']
-        account_move_line_obj = self.env['account.move.line']
+        invoice = self.env['account.move']._assemble_invoices([self._prepare_single_task_invoice_vals(task)])
+        self._debug_trace('_create_single_task_invoice').log(
+            "Factura creada con ID: %s para la tarea %s (ID: %s)", invoice.id, task.name, task.id)
+        return invoice
 
+    def _prepare_single_task_invoice_vals(self, task):
+        """Valores de la factura mensual individual de la tarea, con sus líneas"""
         # Validación de egreso_completo
         if task.egreso_completo:
             raise ValidationError(f"Este tránsito no se puede facturar porque está en 'Egreso Completo'. (Tarea: {task.name})")
 
         # Buscar productos con el paquete de facturación de almacenamiento
-        products = self.env['product.product'].search([('stock_invoice_pack', '=', True)])
+        products = self.env['product.template']._get_billing_pack_products('stock_invoice_pack')
         if not products:
             raise ValidationError(f"No hay productos configurados para facturación de almacenamiento para la tarea {task.name}.")
 
@@ -497,96 +739,150 @@ class ProjectTask(models.Model):
             "BAJA EN IIBB CABA - BS AS DESDE 31/08/2024"
         )
 
-        # Crear la factura para la tarea
-        invoice = account_move_obj.create({
-            'partner_id': task.partner_id.id,
-            'move_type': 'out_invoice',
-            'invoice_origin': task.name,
-            'invoice_date': invoice_date,
-            'narration': narration,
-        })
-
-        _logger.info(f"Factura creada con ID: {invoice.id} para la tarea {task.name} (ID: {task.id})")
-
         # Obtener tasa de cambio USD
-        usd_currency = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-        rate = 1.0
-        if usd_currency:
-            rate_data = usd_currency._get_rates(self.env.company, fields.Date.context_today(self))
-            rate = 1 / rate_data.get(usd_currency.id, 1.0)
-
-        # Agregar líneas de factura
-        for product in products:
+        rate = self.env['res.currency']._get_usd_rate(self.env.company, fields.Date.context_today(self))
+
+        # Armar las líneas de factura
+        line_vals_list = []
+        for product, pack in products:
             # Determinar si el producto requiere cálculo personalizado
-            calculate_custom = product.product_tmpl_id.is_storage or product.product_tmpl_id.fob_total
+            calculate_custom = pack.is_storage or pack.fob_total
 
-            if product.product_tmpl_id.fob_total:
+            if pack.fob_total:
                 quantity = 1
                 name = f"{product.name} - {task.name} - Fob total:{task.total_fob} - USD:{rate}"
                 fob_total = task.total_fob
 
-                account_move_line_obj.create({
-                    'move_id': invoice.id,
+                line_vals_list.append({
                     'product_id': product.id,
                     'quantity': quantity,
                     'calculate_custom': calculate_custom,
                     'fob_total': fob_total,
                     'name': name,
-                    'account_id': product.categ_id.property_account_income_categ_id.id,
+                    'account_id': pack.account_id,
                     'task_id': task.id,
                 })
 
-            elif product.product_tmpl_id.is_storage:
+            elif pack.is_storage:
                 quantity = task.total_m3 or 1
                 name = f"{product.name} - {task.name} - {quantity} m3 - {task.days_to_invoiced} días"
 
-                account_move_line_obj.create({
-                    'move_id': invoice.id,
+                line_vals_list.append({
                     'product_id': product.id,
                     'quantity': quantity,
                     'days_storage': task.days_to_invoiced,
                     'calculate_custom': calculate_custom,
-                    'price_unit': product.lst_price,
+                    'price_unit': pack.lst_price,
                     'name': name,
-                    'account_id': product.categ_id.property_account_income_categ_id.id,
+                    'account_id': pack.account_id,
                     'task_id': task.id,
                 })
 
             else:
                 # Productos normales
-                account_move_line_obj.create({
-                    'move_id': invoice.id,
+                line_vals_list.append({
                     'product_id': product.id,
                     'quantity': 1,
                     'calculate_custom': False,
-                    'price_unit': product.lst_price,
+                    'price_unit': pack.lst_price,
                     'name': f"{product.name} - {task.name}",
-                    'account_id': product.categ_id.property_account_income_categ_id.id,
+                    'account_id': pack.account_id,
                     'task_id': task.id,
                 })
 
-        # Actualizar precios según lista de precios
-        try:
-            invoice.button_update_prices_from_pricelist()
-        except Exception as e:
-            _logger.error(f"Error al actualizar precios para la factura {invoice.id}: {str(e)}")
-
-        return invoice
+        return {
+            'partner_id': task.partner_id.id,
+            'move_type': 'out_invoice',
+            'invoice_origin': task.name,
+            'invoice_date': invoice_date,
+            'narration': narration,
+            'invoice_line_ids': [(0, 0, line_vals) for line_vals in line_vals_list],
+        }
 
     # echo ok: sumarizar fob total en le producto seguros (revisar config producto) de todos los transitos que esten unificados en la factura. En el almacenamiento mensual desde tareas revisar que se haya implementado la linea del producto seguro (fob)
+    def _check_monthly_billing_tasks(self):
+        invalid_tasks = self.filtered('egreso_completo')
+        if invalid_tasks:
+            task_names = ', '.join(invalid_tasks.mapped('name'))
+            raise ValidationError(f"Las siguientes tareas tienen 'Egreso Completo' en True y no se facturarán: {task_names}")
+
     def action_generate_monthly_invoices(self):
+        self._generate_monthly_invoices()
+        return True
+
+    def action_generate_monthly_invoices_background(self):
+        """Lanza la facturación mensual en segundo plano, repartida por cliente entre varios procesos"""
+        self._check_monthly_billing_tasks()
+        run = self.env['project.task.billing.run'].create({'task_ids': [(6, 0, self.ids)]})
+        run._start()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Facturación mensual',
+            'res_model': 'project.task.billing.run',
+            'view_mode': 'form',
+            'res_id': run.id,
+            'target': 'current',
+        }
+
+    def _generate_monthly_invoices(self, run=None):
+        """
+        Genera las facturas mensuales de las tareas y devuelve las facturas creadas.
+
+        Cada tarea queda en el registro de la corrida ``run`` (por defecto una nueva): las tareas
+        ya facturadas en el período no se vuelven a facturar.
+        """
+        _logger.info("Iniciando el proceso de generación de facturas mensuales...")
+        self._check_monthly_billing_tasks()
+        # La corrida y su registro son internos: quien puede facturar los escribe aunque no tenga acceso a esos modelos
+        run = run or self.env['project.task.billing.run'].sudo().create({'task_ids': [(6, 0, self.ids)]})
+
+        # Las tareas que otro proceso está facturando en este período se omiten
+        tasks = self._lock_for_billing(run.period)
+        skipped = self - tasks
+        if skipped:
+            _logger.warning("Tareas omitidas por estar en facturación en otro proceso: %s", ', '.join(skipped.mapped('name')))
+        # Una tarea se factura una sola vez por período, con cualquiera de los tipos de facturación
+        lines = self.env['project.task.billing.run.line'].sudo()._reserve(run, tasks, 'monthly', run.period)
+        # Las facturas se crean con el usuario que factura, no con el del registro
+        to_bill = self.browse(lines.task_id.ids)
+        billed = self - skipped - to_bill
+        if billed:
+            _logger.info("Tareas ya facturadas en el período %s: %s", run.period, ', '.join(billed.mapped('name')))
+
+        # Todas las facturas (individuales y agrupadas) en un solo create; precios al final
+        start = fields.Datetime.now()
+        invoice_groups = to_bill._prepare_monthly_invoice_groups()
+        invoices = self.env['account.move']._assemble_invoices([vals for group_tasks, vals in invoice_groups])
+        lines._mark_done({
+            task.id: invoice
+            for (group_tasks, vals), invoice in zip(invoice_groups, invoices)
+            for task in group_tasks
+        }, start)
+
+        _logger.info("Proceso de generación de facturas mensuales completado")
+        trace = self._debug_trace('_generate_monthly_invoices')
+        trace.count('tareas', len(lines))
+        trace.count('tareas omitidas', len(skipped))
+        trace.count('tareas ya facturadas', len(billed))
+        trace.count('facturas', len(invoices))
+        trace.summary()
+        return invoices
+
+    def _prepare_monthly_invoice_vals_list(self):
+        """
+        Valores (con sus líneas) de las facturas mensuales de las tareas: una por tarea para los
+        clientes sin facturación mensual y una por cliente e IMO para los demás.
+        """
+        return [vals for tasks, vals in self._prepare_monthly_invoice_groups()]
+
+    def _prepare_monthly_invoice_groups(self):
+        """Lista de (tareas, valores de factura) de la facturación mensual, en el orden de creación"""
         # Agrupar tareas por cliente y por IMO
         grouped_tasks = {}
-        invalid_tasks = []
-        
-        _logger.info("Iniciando el proceso de generación de facturas mensuales...")
+        invoice_groups = []
 
         # Primera agrupación: por cliente y por IMO
         for task in self:
-            if task.egreso_completo:
-                invalid_tasks.append(task)
-                continue
-
             partner = task.partner_id
             if partner.monthly_invoice:
                 # Clave compuesta: (partner_id, is_imo)
@@ -595,12 +891,8 @@ class ProjectTask(models.Model):
                     grouped_tasks[key] = []
                 grouped_tasks[key].append(task)
             else:
-                # Crear factura individual
-                self._create_single_task_invoice(task)
-
-        if invalid_tasks:
-            task_names = ', '.join([task.name for task in invalid_tasks])
-            raise ValidationError(f"Las siguientes tareas tienen 'Egreso Completo' en True y no se facturarán: {task_names}")
+                # Factura individual
+                invoice_groups.append((task, self._prepare_single_task_invoice_vals(task)))
 
         # Procesar grupos de tareas
         for (partner_id, is_imo), tasks in grouped_tasks.items():
@@ -633,31 +925,17 @@ class ProjectTask(models.Model):
                 "BAJA EN IIBB CABA - BS AS DESDE 31/08/2024"
             )
 
-            # Crear factura
-            invoice = self.env['account.move'].create({
-                'partner_id': partner.id,
-                'move_type': 'out_invoice',
-                'invoice_origin': ', '.join([task.name for task in tasks]),
-                'invoice_date': invoice_date,
-                'narration': narration,
-            })
-
             # Obtener productos según IMO
-            domain = [
-                ('stock_invoice_pack', '=', True),
-                ('is_imo', '=', is_imo)
-            ]
-            products = self.env['product.product'].search(domain)
+            products = self.env['product.template']._get_billing_pack_products(
+                'stock_invoice_pack', 'imo_only' if is_imo else 'non_imo_only')
 
             # Obtener tasa de cambio USD
-            usd_currency = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-            if not usd_currency:
-                raise ValidationError("No se encontró la divisa USD en el sistema.")
-            rate = 1 / usd_currency.rate
+            rate = self.env['res.currency']._get_usd_rate(raise_if_missing=True)
 
             # Procesar productos
-            for product in products:
-                if product.product_tmpl_id.fob_total:
+            line_vals_list = []
+            for product, pack in products:
+                if pack.fob_total:
                     # Sumarizar FOB de todas las tareas
                     total_fob = 0
                     task_details = []
@@ -668,35 +946,28 @@ class ProjectTask(models.Model):
 
                     if total_fob > 0:
                         name = f"FOB Total - {' | '.join(task_details)} - USD:{rate}"
-                        self.env['account.move.line'].create({
-                            'move_id': invoice.id,
+                        line_vals_list.append({
                             'product_id': product.id,
                             'quantity': 1,
                             'calculate_custom': True,
                             'fob_total': total_fob,
                             'name': name,
-                            'account_id': product.categ_id.property_account_income_categ_id.id,
+                            'account_id': pack.account_id,
                         })
 
-                elif product.product_tmpl_id.is_storage:
+                elif pack.is_storage:
                     # Crear línea por cada tarea para storage
                     for task in tasks:
-                        subtotal = task.total_m3 * days_in_month * product.lst_price
-                        if subtotal < product.product_tmpl_id.min_price:
-                            price_subtotal = product.product_tmpl_id.min_price
-                        else:
-                            price_subtotal = subtotal
-
+                        # Precio por m3 y por día: el subtotal (con el mínimo) lo calcula la línea
                         name = f"{product.name} - {task.name} - {task.total_m3} m3 - {days_in_month} días"
-                        self.env['account.move.line'].create({
-                            'move_id': invoice.id,
+                        line_vals_list.append({
                             'product_id': product.id,
                             'quantity': task.total_m3,
                             'days_storage': days_in_month,
                             'calculate_custom': True,
-                            'price_unit': price_subtotal,
+                            'price_unit': pack.lst_price,
                             'name': name,
-                            'account_id': product.categ_id.property_account_income_categ_id.id,
+                            'account_id': pack.account_id,
                             'task_id': task.id,
                         })
 
@@ -704,23 +975,114 @@ class ProjectTask(models.Model):
                     # Productos normales
                     for task in tasks:
                         name = f"{product.name} - {task.name}"
-                        self.env['account.move.line'].create({
-                            'move_id': invoice.id,
+                        line_vals_list.append({
                             'product_id': product.id,
                             'quantity': 1,
                             'calculate_custom': False,
-                            'price_unit': product.lst_price,
+                            'price_unit': pack.lst_price,
                             'name': name,
-                            'account_id': product.categ_id.property_account_income_categ_id.id,
+                            'account_id': pack.account_id,
                             'task_id': task.id,
                         })
 
+            invoice_groups.append((self.env['project.task'].concat(*tasks), {
+                'partner_id': partner.id,
+                'move_type': 'out_invoice',
+                'invoice_origin': ', '.join([task.name for task in tasks]),
+                'invoice_date': invoice_date,
+                'narration': narration,
+                'invoice_line_ids': [(0, 0, line_vals) for line_vals in line_vals_list],
+            }))
+
+        return invoice_groups
+
+
+
+    def _forecast_billing(self, mode='monthly'):
+        """
+        Simula la facturación de las tareas sin crear registros.
+
+        Arma los mismos valores que ``_generate_monthly_invoices`` (``mode='monthly'``) o que
+        ``action_create_storage_invoice`` (``mode='storage'``), completa los precios de las líneas
+        como al crearlas y aplica las reglas de ``_compute_custom_subtotal`` en memoria. No incluye
+        los ajustes de la lista de precios. Las tareas con egreso completo se omiten.
+
+        Devuelve una lista de dicts, uno por línea de factura proyectada, más una fila con ``error``
+        por cada tarea que no se pudo simular.
+        """
+        tasks = self.filtered(lambda task: not task.egreso_completo)
+        # Las tareas que no se pueden facturar (p. ej. sin productos o sin cotización) quedan como
+        # filas de error en lugar de cortar la simulación
+        rows = []
+        if mode == 'storage':
+            vals_list = []
+            for task in tasks:
+                try:
+                    vals_list.append(task._prepare_storage_invoice_vals())
+                except UserError as e:
+                    rows.append(task._get_forecast_error_row(e))
+        else:
             try:
-                invoice.button_update_prices_from_pricelist()
-            except Exception as e:
-                _logger.error(f"Error al actualizar precios para la factura {invoice.id}: {str(e)}")
-
-        _logger.info("Proceso de generación de facturas mensuales completado")
-        return True
-
+                vals_list = tasks._prepare_monthly_invoice_vals_list()
+            except UserError:
+                # Se aíslan las tareas con error y las demás se agrupan como en la facturación real
+                failed = self.browse()
+                for task in tasks:
+                    try:
+                        task._prepare_monthly_invoice_vals_list()
+                    except UserError as e:
+                        rows.append(task._get_forecast_error_row(e))
+                        failed |= task
+                tasks -= failed
+                vals_list = tasks._prepare_monthly_invoice_vals_list()
+
+        line_obj = self.env['account.move.line']
+        all_line_vals = [line_vals for vals in vals_list for __, __, line_vals in vals['invoice_line_ids']]
+        line_obj._prepare_custom_price_vals(all_line_vals)
+        products = self.env['product.product'].browse({line_vals['product_id'] for line_vals in all_line_vals})
+        partners = self.env['res.partner'].browse({vals['partner_id'] for vals in vals_list})
+        task_names = dict(zip(tasks.ids, tasks.mapped('name')))
+        rate = self.env['res.currency']._get_usd_rate(self.env.company, fields.Date.context_today(self))
+
+        for index, vals in enumerate(vals_list):
+            partner = partners.browse(vals['partner_id'])
+            for __, __, line_vals in vals['invoice_line_ids']:
+                product = products.browse(line_vals['product_id'])
+                quantity = line_vals.get('quantity', 1.0)
+                price_unit = line_vals.get('price_unit', product.lst_price)
+                if line_vals.get('calculate_custom'):
+                    amount = line_obj._get_custom_subtotal(
+                        product.product_tmpl_id, quantity, price_unit, line_vals.get('fob_total'), rate)
+                else:
+                    amount = price_unit * quantity
+                rows.append({
+                    'invoice': index + 1,
+                    'partner_id': partner.id,
+                    'partner_name': partner.display_name,
+                    'task_id': line_vals.get('task_id') or False,
+                    'task_name': task_names.get(line_vals.get('task_id'), vals['invoice_origin']),
+                    'product_name': product.display_name,
+                    'quantity': quantity,
+                    'days_storage': line_vals.get('days_storage') or 0,
+                    'price_unit': price_unit,
+                    'amount': amount,
+                    'error': False,
+                })
+        return rows
 
+    def _get_forecast_error_row(self, error):
+        """Fila de la previsión para una tarea que no se puede facturar"""
+        self.ensure_one()
+        return {
+            'invoice': False,
+            'partner_id': self.partner_id.id,
+            'partner_name': self.partner_id.display_name or '',
+            'task_id': self.id,
+            'task_name': self.name,
+            'product_name': '',
+            'quantity': 0.0,
+            'days_storage': 0,
+            'price_unit': 0.0,
+            'amount': 0.0,
+            'error': str(error.args[0] if error.args else error),
+        }
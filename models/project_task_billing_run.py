@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import models, fields, api, tools
+
+from .cron_budget import CronBudget
+
+_logger = logging.getLogger(__name__)
+
+# Cron que procesa las unidades pendientes de las corridas, cada una en su propia transacción; los
+# demás procesos son copias del mismo cron, que Odoo ejecuta en paralelo en sus hilos de cron
+BILLING_RUN_CRON = 'dev_invoice.ir_cron_billing_run_units'
+# Cantidad de procesos que facturan en paralelo (ir.config_parameter)
+BILLING_WORKERS_PARAM = 'dev_invoice.billing_workers'
+DEFAULT_BILLING_WORKERS = 2
+# Una unidad tomada por un proceso queda reservada este tiempo; después otro proceso puede retomarla
+BILLING_UNIT_STALE_AFTER = timedelta(minutes=30)
+
+BILLING_TYPES = [
+    ('monthly', 'Mensual'),
+    ('storage', 'Almacenamiento'),
+]
+
+
+class ProjectTaskBillingRun(models.Model):
+    _name = 'project.task.billing.run'
+    _description = 'Corrida de facturación mensual'
+    _order = 'id desc'
+
+    name = fields.Char(string='Nombre', required=True, default=lambda self: f"Facturación mensual {fields.Date.context_today(self)}")
+    user_id = fields.Many2one('res.users', string='Usuario', default=lambda self: self.env.user, readonly=True)
+    task_ids = fields.Many2many('project.task', string='Tareas', readonly=True)
+    billing_type = fields.Selection(BILLING_TYPES, string='Tipo de facturación', default='monthly', required=True, readonly=True)
+    period = fields.Date(string='Período', required=True, readonly=True,
+                         default=lambda self: self.env['project.task']._get_billing_period(),
+                         help="Primer día del mes facturado.")
+    unit_ids = fields.One2many('project.task.billing.run.unit', 'run_id', string='Unidades de trabajo', readonly=True)
+    line_ids = fields.One2many('project.task.billing.run.line', 'run_id', string='Registro', readonly=True)
+    worker_count = fields.Integer(string='Procesos', readonly=True)
+
+    state = fields.Selection([
+        ('draft', 'Borrador'),
+        ('running', 'En proceso'),
+        ('done', 'Finalizada'),
+        ('failed', 'Con errores'),
+    ], string='Estado', compute='_compute_progress')
+    unit_count = fields.Integer(string='Unidades', compute='_compute_progress')
+    unit_done_count = fields.Integer(string='Unidades facturadas', compute='_compute_progress')
+    unit_failed_count = fields.Integer(string='Unidades con error', compute='_compute_progress')
+    invoice_count = fields.Integer(string='Facturas creadas', compute='_compute_progress')
+    progress = fields.Float(string='Avance (%)', compute='_compute_progress')
+
+    @api.depends('unit_ids.state', 'unit_ids.invoice_ids', 'line_ids.state', 'line_ids.invoice_id')
+    def _compute_progress(self):
+        for run in self:
+            units = run.unit_ids
+            run.unit_count = len(units)
+            run.unit_done_count = len(units.filtered(lambda unit: unit.state == 'done'))
+            run.unit_failed_count = len(units.filtered(lambda unit: unit.state == 'failed'))
+            run.invoice_count = len(units.invoice_ids | run.line_ids.invoice_id)
+            # Las corridas sin unidades (manuales o del cron de almacenamiento) avanzan según su registro
+            items = units or run.line_ids
+            done = items.filtered(lambda item: item.state == 'done')
+            failed = items.filtered(lambda item: item.state == 'failed')
+            run.progress = 100.0 * (len(done) + len(failed)) / len(items) if items else 0.0
+            if not items:
+                run.state = 'draft'
+            elif len(done) + len(failed) < len(items):
+                run.state = 'running'
+            else:
+                run.state = 'failed' if failed else 'done'
+
+    def _prepare_units(self):
+        """Una unidad de trabajo por cliente: sus tareas se facturan juntas en una transacción"""
+        self.ensure_one()
+        unit_vals = []
+        for partner, tasks in self._group_tasks_by_partner(self.task_ids).items():
+            unit_vals.append({
+                'run_id': self.id,
+                'partner_id': partner.id,
+                'task_ids': [(6, 0, tasks.ids)],
+            })
+        return self.env['project.task.billing.run.unit'].create(unit_vals)
+
+    @api.model
+    def _group_tasks_by_partner(self, tasks):
+        grouped = {}
+        for task in tasks:
+            grouped.setdefault(task.partner_id, self.env['project.task'])
+            grouped[task.partner_id] |= task
+        return grouped
+
+    def _start(self):
+        """Crea las unidades (si aún no existen) y programa los procesos que las facturan en paralelo"""
+        self.ensure_one()
+        if not self.unit_ids:
+            self._prepare_units()
+        pending = self.unit_ids.filtered(lambda unit: unit.state == 'pending')
+        if tools.config['test_enable']:
+            # En tests se factura en la misma transacción
+            self.worker_count = 0
+            for unit in pending:
+                unit._process()
+            return
+        # El disparo queda registrado en esta transacción: los procesos arrancan cuando la corrida está confirmada
+        self.worker_count = len(self.env['project.task.billing.run.unit']._trigger_workers(len(pending)))
+
+    def action_resume(self):
+        """
+        Reintenta las unidades con error y retoma las pendientes que quedaron sin procesar (nunca
+        iniciadas o tomadas hace más de ``BILLING_UNIT_STALE_AFTER``, p. ej. por un proceso cortado).
+        """
+        stale_before = fields.Datetime.now() - BILLING_UNIT_STALE_AFTER
+        for run in self:
+            units = run.unit_ids.filtered(lambda unit: unit.state == 'failed' or (
+                unit.state == 'pending' and (not unit.date_start or unit.date_start < stale_before)))
+            units.write({'state': 'pending', 'error': False, 'date_start': False, 'date_end': False})
+            run._start()
+        return True
+
+
+class ProjectTaskBillingRunUnit(models.Model):
+    _name = 'project.task.billing.run.unit'
+    _description = 'Unidad de trabajo de la corrida de facturación'
+    _order = 'id'
+
+    run_id = fields.Many2one('project.task.billing.run', string='Corrida', required=True, ondelete='cascade', index=True)
+    partner_id = fields.Many2one('res.partner', string='Cliente', readonly=True)
+    task_ids = fields.Many2many('project.task', string='Tareas', readonly=True)
+    invoice_ids = fields.Many2many('account.move', string='Facturas', readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Facturada'),
+        ('failed', 'Error'),
+    ], string='Estado', default='pending', required=True, readonly=True, index=True)
+    error = fields.Text(string='Error', readonly=True)
+    date_start = fields.Datetime(string='Inicio', readonly=True)
+    date_end = fields.Datetime(string='Fin', readonly=True)
+
+    @api.model
+    def _claim_next(self, run_id=None):
+        """
+        Toma la siguiente unidad pendiente (de la corrida, si se indica) que ningún proceso tenga
+        reservada y la reserva con ``date_start``. Quien llama confirma la reserva antes de facturar,
+        así los demás procesos (y ``action_resume``) la ven en curso.
+        """
+        self.flush_model(['state', 'date_start', 'date_end'])
+        self.env.cr.execute("""
+            UPDATE project_task_billing_run_unit
+               SET date_start = now() at time zone 'UTC', date_end = NULL
+             WHERE id = (
+                    SELECT id FROM project_task_billing_run_unit
+                     WHERE state = 'pending' AND (%s IS NULL OR run_id = %s)
+                       AND (date_start IS NULL OR date_start < %s)
+                  ORDER BY id
+                     LIMIT 1
+                       FOR UPDATE SKIP LOCKED)
+         RETURNING id
+        """, [run_id, run_id, fields.Datetime.now() - BILLING_UNIT_STALE_AFTER])
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        unit = self.browse(row[0])
+        unit.invalidate_recordset(['date_start', 'date_end'])
+        return unit
+
+    @api.model
+    def _get_worker_crons(self, count):
+        """Los ``count`` crons que procesan unidades: el del módulo y, si hacen falta, copias suyas"""
+        base = self.env.ref(BILLING_RUN_CRON, raise_if_not_found=False)
+        if not base or count < 1:
+            return self.env['ir.cron']
+        cron_obj = self.env['ir.cron'].sudo().with_context(active_test=False)
+        crons = cron_obj.search([('model_id', '=', base.model_id.id), ('code', '=', base.code)], order='id')
+        crons = base.sudo() | (crons - base)
+        if len(crons) < count:
+            crons |= cron_obj.create([{
+                'name': f"{base.name} ({index})",
+                'model_id': base.model_id.id,
+                'state': 'code',
+                'code': base.code,
+                'user_id': base.user_id.id,
+                'interval_number': base.interval_number,
+                'interval_type': base.interval_type,
+                'numbercall': -1,
+                'doall': False,
+            } for index in range(len(crons) + 1, count + 1)])
+        crons = crons[:count]
+        crons.filtered(lambda cron: not cron.active).write({'active': True})
+        return crons
+
+    @api.model
+    def _trigger_workers(self, pending_count):
+        """Programa hasta ``dev_invoice.billing_workers`` procesos (no más que unidades pendientes) y los devuelve"""
+        workers = int(self.env['ir.config_parameter'].sudo().get_param(BILLING_WORKERS_PARAM, DEFAULT_BILLING_WORKERS))
+        crons = self._get_worker_crons(min(max(workers, 1), pending_count))
+        for cron in crons:
+            cron._trigger()
+        if crons:
+            _logger.info("Facturación mensual: %s procesos programados para %s unidades pendientes", len(crons), pending_count)
+        return crons
+
+    @api.model
+    def _cron_process_units(self, time_budget=None, record_budget=None):
+        """
+        Procesa unidades pendientes de todas las corridas, una transacción por unidad. Cada cron de
+        ``_get_worker_crons`` ejecuta este método en paralelo con los demás; al agotar el presupuesto
+        (``CronBudget``) vuelve a programar los procesos para las unidades que quedan.
+        """
+        budget = CronBudget(self.env, time_budget, record_budget)
+        while not budget.exhausted:
+            unit = self._claim_next()
+            if not unit:
+                return
+            self.env.cr.commit()  # La reserva queda visible para los demás procesos
+            # Se factura con el usuario (y su compañía) que lanzó la corrida
+            unit.with_user(unit.run_id.user_id or self.env.user)._process()
+            budget.consume(1)
+            self.env.cr.commit()  # Commit por unidad
+        self._trigger_workers(self.search_count([('state', '=', 'pending')]))
+
+    def _process(self):
+        self.ensure_one()
+        # Las unidades tomadas por un proceso ya tienen su inicio (la reserva de ``_claim_next``)
+        start = self.date_start or fields.Datetime.now()
+        try:
+            with self.env.cr.savepoint():
+                invoices = self.task_ids._generate_monthly_invoices(self.run_id)
+        except Exception as e:
+            _logger.exception("Error al facturar el cliente %s en la corrida %s", self.partner_id.display_name, self.run_id.id)
+            self.env['project.task.billing.run.line'].sudo()._reserve(
+                self.run_id, self.task_ids, 'monthly', self.run_id.period)._mark_failed(str(e), start)
+            self.write({'state': 'failed', 'error': str(e), 'date_start': start, 'date_end': fields.Datetime.now()})
+        else:
+            self.write({
+                'state': 'done',
+                'error': False,
+                'invoice_ids': [(6, 0, invoices.ids)],
+                'date_start': start,
+                'date_end': fields.Datetime.now(),
+            })
+
+
+class ProjectTaskBillingRunLine(models.Model):
+    """Registro de facturación: una línea por tarea y período.
+
+    El índice único (tarea, período) hace idempotente la facturación: al repetir una corrida,
+    o al retomar una que se interrumpió, las tareas ya facturadas se omiten, las que fallaron
+    se reintentan y las pendientes se retoman sin volver a recorrer todas las tareas. La
+    facturación mensual y la de almacenamiento comparten la clave, así que gana el primer tipo
+    que factura la tarea en el período; ``billing_type`` registra cuál fue.
+    """
+    _name = 'project.task.billing.run.line'
+    _description = 'Registro de facturación por tarea y período'
+    _order = 'id'
+
+    run_id = fields.Many2one('project.task.billing.run', string='Corrida', required=True, ondelete='cascade', index=True, readonly=True)
+    task_id = fields.Many2one('project.task', string='Tarea', required=True, ondelete='cascade', index=True, readonly=True)
+    billing_type = fields.Selection(BILLING_TYPES, string='Tipo de facturación', required=True, readonly=True)
+    period = fields.Date(string='Período', required=True, readonly=True)
+    invoice_id = fields.Many2one('account.move', string='Factura', ondelete='set null', index=True, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Facturada'),
+        ('failed', 'Error'),
+    ], string='Estado', default='pending', required=True, readonly=True, index=True)
+    error = fields.Text(string='Error', readonly=True)
+    date_start = fields.Datetime(string='Inicio', readonly=True)
+    date_end = fields.Datetime(string='Fin', readonly=True)
+    duration = fields.Float(string='Duración (s)', readonly=True)
+
+    _sql_constraints = [
+        ('task_billing_period_uniq', 'unique(task_id, period)',
+         'Cada tarea se factura una sola vez por período.'),
+    ]
+
+    @api.model
+    def _reserve(self, run, tasks, billing_type, period):
+        """
+        Registra las tareas en la corrida y devuelve las líneas que quedan por facturar.
+
+        Las tareas ya facturadas en el período (por esta u otra corrida, con cualquier tipo de
+        facturación) no se devuelven; las pendientes o con error de otras corridas pasan a esta
+        con el tipo de facturación de la corrida.
+        """
+        if not tasks:
+            return self.browse()
+        self.flush_model()
+        self.env.cr.execute(f"""
+            INSERT INTO {self._table} (run_id, task_id, billing_type, period, state, create_uid, create_date, write_uid, write_date)
+            SELECT %s, task_id, %s, %s, 'pending', %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+              FROM unnest(%s::int[]) AS task_id
+            ON CONFLICT (task_id, period) DO NOTHING
+        """, [run.id, billing_type, period, self.env.uid, self.env.uid, tasks.ids])
+        run.invalidate_recordset(['line_ids'])
+        lines = self.search([
+            ('task_id', 'in', tasks.ids),
+            ('period', '=', period),
+            ('state', '!=', 'done'),
+        ])
+        lines.filtered(lambda line: line.run_id != run or line.billing_type != billing_type).write({
+            'run_id': run.id,
+            'billing_type': billing_type,
+        })
+        return lines
+
+    def _mark_done(self, invoice_by_task, start):
+        """Marca las líneas como facturadas con la factura de su tarea (``{id de tarea: factura}``)"""
+        end = fields.Datetime.now()
+        lines_by_invoice = {}
+        for line in self:
+            invoice = invoice_by_task[line.task_id.id]
+            lines_by_invoice.setdefault(invoice, self.browse())
+            lines_by_invoice[invoice] |= line
+        for invoice, lines in lines_by_invoice.items():
+            lines.write({
+                'state': 'done',
+                'invoice_id': invoice.id,
+                'error': False,
+                'date_start': start,
+                'date_end': end,
+                'duration': (end - start).total_seconds(),
+            })
+
+    @api.model
+    def _reset_for_invoices(self, invoices):
+        """Las líneas facturadas con ``invoices`` (canceladas) quedan con error para volver a facturarse"""
+        lines = self.search([('invoice_id', 'in', invoices.ids), ('state', '=', 'done')])
+        for invoice in invoices:
+            lines.filtered(lambda line: line.invoice_id == invoice).write({
+                'state': 'failed',
+                'invoice_id': False,
+                'error': f"Factura {invoice.name or invoice.id} cancelada",
+            })
+
+    def _mark_failed(self, error, start):
+        end = fields.Datetime.now()
+        self.write({
+            'state': 'failed',
+            'invoice_id': False,
+            'error': error,
+            'date_start': start,
+            'date_end': end,
+            'duration': (end - start).total_seconds(),
+        })
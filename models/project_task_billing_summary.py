@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import defaultdict
+
+from odoo import models, fields, api
+from odoo.tools import split_every
+
+_logger = logging.getLogger(__name__)
+
+
+class ProjectTaskBillingSummary(models.Model):
+    """Resumen de facturación por tarea.
+
+    Se mantiene con deltas cuando una factura pasa a publicada o deja de estarlo (borrador,
+    cancelada, eliminada) y cuando cambia la relación factura-tarea de una factura publicada,
+    así que los campos de la tarea leen una fila en lugar de recorrer el historial de facturas.
+    """
+    _name = 'project.task.billing.summary'
+    _description = 'Resumen de facturación por tarea'
+
+    task_id = fields.Many2one('project.task', string='Tarea', required=True, ondelete='cascade', index=True, readonly=True)
+    amount_billed = fields.Float(string='Importe facturado', readonly=True,
+                                 help="Importe sin impuestos de las facturas y notas de crédito publicadas de la tarea.")
+    days_billed = fields.Integer(string='Días de almacenamiento facturados', readonly=True)
+    last_storage_period = fields.Date(string='Último período de almacenamiento', readonly=True,
+                                      help="Fecha de la última factura de almacenamiento publicada de la tarea.")
+    # La mantiene el ORM al escribir date_next_billing en la tarea (_post, unlink) y el SQL de _refresh_last_storage_period
+    next_billing_date = fields.Date(related='task_id.date_next_billing', string='Próxima facturación', store=True, readonly=True,
+                                    help="Próxima facturación de la tarea: 30 días después de su última factura de almacenamiento publicada.")
+
+    _sql_constraints = [
+        ('task_uniq', 'unique(task_id)', 'Cada tarea tiene un único resumen de facturación.'),
+    ]
+
+    def init(self):
+        self.env.cr.execute(f"SELECT 1 FROM {self._table} LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._rebuild()
+
+    @api.model
+    def _apply_move_deltas(self, moves, sign):
+        """Suma (``sign=1``) o resta (``sign=-1``) el aporte de las facturas publicadas a sus tareas"""
+        moves = moves.filtered('id')
+        if not moves:
+            return
+        amounts = defaultdict(float)
+        days = defaultdict(int)
+        storage_task_ids = set()
+        for move in moves:
+            if move.move_type in ['out_invoice', 'out_refund']:
+                for task in move.task_id:
+                    amounts[task.id] += sign * move.amount_untaxed_signed
+                    storage_task_ids.add(task.id)
+            for line in move.invoice_line_ids:
+                if line.task_id and line.days_storage:
+                    days[line.task_id.id] += sign * line.days_storage
+                    storage_task_ids.add(line.task_id.id)
+        self._apply_deltas(amounts, days)
+        self._refresh_last_storage_period(storage_task_ids)
+
+    @api.model
+    def _apply_relation_deltas(self, pairs, sign):
+        """Aporte de importes por pares (factura, tarea) agregados o quitados en facturas publicadas"""
+        moves = self.env['account.move'].browse({move_id for move_id, task_id in pairs})
+        posted = {move.id: move for move in moves if move.state == 'posted' and move.move_type in ['out_invoice', 'out_refund']}
+        amounts = defaultdict(float)
+        for move_id, task_id in pairs:
+            if move_id in posted:
+                amounts[task_id] += sign * posted[move_id].amount_untaxed_signed
+        if amounts:
+            self._apply_deltas(amounts, {})
+            self._refresh_last_storage_period(amounts)
+
+    @api.model
+    def _apply_deltas(self, amounts, days):
+        task_ids = set(amounts) | set(days)
+        if not task_ids:
+            return
+        rows = [(task_id, amounts.get(task_id, 0.0), days.get(task_id, 0)) for task_id in task_ids]
+        for batch in split_every(500, rows):
+            # Suma atómica en la base: dos transacciones que publican facturas de la misma tarea no se pisan
+            self.env.cr.execute(f"""
+                INSERT INTO {self._table} (task_id, amount_billed, days_billed, create_uid, create_date, write_uid, write_date)
+                VALUES {", ".join(["(%s, %s, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')"] * len(batch))}
+                ON CONFLICT (task_id) DO UPDATE
+                   SET amount_billed = COALESCE({self._table}.amount_billed, 0) + EXCLUDED.amount_billed,
+                       days_billed = COALESCE({self._table}.days_billed, 0) + EXCLUDED.days_billed,
+                       write_uid = EXCLUDED.write_uid,
+                       write_date = EXCLUDED.write_date
+            """, [value for task_id, amount, day in batch for value in (task_id, amount, day, self.env.uid, self.env.uid)])
+        self._notify_changed(task_ids, ['amount_billed', 'days_billed'])
+
+    @api.model
+    def _refresh_last_storage_period(self, task_ids):
+        """Recalcula la fecha de la última factura de almacenamiento publicada de las tareas y copia su próxima facturación"""
+        task_ids = list(task_ids)
+        if not task_ids:
+            return
+        relation = self.env['account.move']._fields['task_id']
+        self.env['project.task'].flush_model(['date_next_billing'])
+        self.env.cr.execute(f"""
+            INSERT INTO {self._table} (task_id, amount_billed, days_billed, last_storage_period, next_billing_date, create_uid, create_date, write_uid, write_date)
+            SELECT task.id, 0, 0, (
+                    SELECT MAX(move.invoice_date)
+                      FROM account_move move
+                     WHERE move.state = 'posted'
+                       AND move.move_type = 'out_invoice'
+                       AND (EXISTS (SELECT 1 FROM account_move_line line
+                                     WHERE line.move_id = move.id AND line.task_id = task.id AND line.days_storage > 0)
+                            OR (move.invoice_origin ILIKE 'storage%%'
+                                AND EXISTS (SELECT 1 FROM {relation.relation} rel
+                                             WHERE rel.{relation.column1} = move.id AND rel.{relation.column2} = task.id)))
+                   ), task.date_next_billing, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+              FROM project_task task
+             WHERE task.id IN %s
+            ON CONFLICT (task_id) DO UPDATE
+               SET last_storage_period = EXCLUDED.last_storage_period,
+                   next_billing_date = EXCLUDED.next_billing_date
+             WHERE {self._table}.last_storage_period IS DISTINCT FROM EXCLUDED.last_storage_period
+                OR {self._table}.next_billing_date IS DISTINCT FROM EXCLUDED.next_billing_date
+        """, [self.env.uid, self.env.uid, tuple(task_ids)])
+        self._notify_changed(task_ids, ['last_storage_period', 'next_billing_date'])
+
+    @api.model
+    def _notify_changed(self, task_ids, fnames):
+        summaries = self.search([('task_id', 'in', list(task_ids))])
+        summaries.invalidate_recordset(fnames)
+        summaries.modified(fnames)
+        # Las filas nuevas aparecen en el One2many de la tarea
+        self.env['project.task'].browse(task_ids).invalidate_recordset(['billing_summary_ids'])
+        self.env['project.task'].browse(task_ids).modified(['billing_summary_ids'])
+
+    @api.model
+    def _rebuild(self):
+        """Reconstruye todos los resúmenes desde el historial de facturas publicadas"""
+        cr = self.env.cr
+        relation = self.env['account.move']._fields['task_id']
+        self.env.flush_all()
+        cr.execute(f"DELETE FROM {self._table}")
+        cr.execute(f"""
+            INSERT INTO {self._table} (task_id, amount_billed, days_billed, create_uid, create_date, write_uid, write_date)
+            SELECT task_id, SUM(amount), SUM(days), %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+              FROM (
+                    SELECT rel.{relation.column2} AS task_id, move.amount_untaxed_signed AS amount, 0 AS days
+                      FROM {relation.relation} rel
+                      JOIN account_move move ON move.id = rel.{relation.column1}
+                     WHERE move.state = 'posted' AND move.move_type IN ('out_invoice', 'out_refund')
+                 UNION ALL
+                    SELECT line.task_id, 0, line.days_storage
+                      FROM account_move_line line
+                     WHERE line.task_id IS NOT NULL AND line.parent_state = 'posted' AND line.days_storage != 0
+                   ) billed
+          GROUP BY task_id
+        """, [self.env.uid, self.env.uid])
+        _logger.info("Resumen de facturación reconstruido para %s tareas", cr.rowcount)
+        cr.execute(f"SELECT task_id FROM {self._table}")
+        task_ids = [row[0] for row in cr.fetchall()]
+        for batch in split_every(1000, task_ids):
+            self._refresh_last_storage_period(batch)
+        self.invalidate_model()
+        summaries = self.search([])
+        summaries.modified(['amount_billed', 'days_billed', 'last_storage_period', 'next_billing_date'])
+        self.env['project.task'].invalidate_model(['billing_summary_ids'])
+        self.env.flush_all()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+# Clave de la memoria de tasas USD dentro de los datos de la transacción
+USD_RATE_CACHE_KEY = 'dev_invoice.usd_rates'
+
+
+class ResCurrency(models.Model):
+    _inherit = 'res.currency'
+
+    @api.model
+    def _get_usd_rate(self, company=None, date=None, raise_if_missing=False):
+        """Tasa de cambio USD (moneda de la compañía por dólar) para la compañía y fecha indicadas.
+
+        El resultado se memoriza por transacción con clave (compañía, fecha) y se invalida
+        cuando se modifica cualquier res.currency.rate.
+        """
+        company = company or self.env.company
+        date = date or fields.Date.context_today(self)
+        cache = self.env.cr.precommit.data.setdefault(USD_RATE_CACHE_KEY, {})
+
+        if 'usd_id' not in cache:
+            cache['usd_id'] = self.search([('name', '=', 'USD')], limit=1).id
+        usd_id = cache['usd_id']
+        if not usd_id:
+            if raise_if_missing:
+                raise ValidationError("No se encontró la divisa USD en el sistema.")
+            return 1.0
+
+        key = (company.id, date)
+        if key not in cache:
+            rate_data = self.browse(usd_id)._get_rates(company, date)
+            cache[key] = 1 / rate_data.get(usd_id, 1.0)
+        return cache[key]
+
+    @api.model
+    def _invalidate_usd_rate_cache(self):
+        self.env.cr.precommit.data.pop(USD_RATE_CACHE_KEY, None)
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+
+class ResCurrencyRate(models.Model):
+    _inherit = 'res.currency.rate'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['res.currency']._invalidate_usd_rate_cache()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env['res.currency']._invalidate_usd_rate_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['res.currency']._invalidate_usd_rate_cache()
+        return res
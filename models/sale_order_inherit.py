@@ -5,45 +5,74 @@ import logging
 
 _logger = logging.getLogger(__name__)
 
+# Clave en cr.precommit.data con los pedidos cuyo tránsito completo queda por revisar
+PENDING_FULL_TRANSIT_KEY = 'dev_invoice.pending_full_transit'
+
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
 
     def check_and_update_order_status(self):
-        for order in self:
+        """
+        Marca las tareas de los pedidos confirmados como tránsito completo cuando ya no queda
+        stock en los lotes con su nombre; las de pedidos cancelados o en borrador se desmarcan.
+        El stock de las tareas se lee de lot_available_qty y solo se escriben los valores que cambian.
+        """
+        orders = self.filtered(lambda order: order.state in ['sale', 'cancel', 'draft'])
+        # Refrescos de stock de la misma transacción (quants o lotes modificados)
+        self.env['project.task']._flush_pending_lot_availability()
+
+        target = {}
+        for order in orders:
             if order.state == 'sale':  # Verificar si el estado es 'pedido de venta'
-                all_tasks_completed = True
-                if order.task_ids:
-                    for task in order.task_ids:
-                        # Verificar si hay stock disponible para el lote con el mismo nombre que la tarea
-                        lot_stock_qty = self.env['stock.quant'].search([
-                            ('lot_id.name', '=', task.name),
-                            ('quantity', '>', 0)
-                        ])
-                        if lot_stock_qty:
-                            all_tasks_completed = False
-                            break
-                    if all_tasks_completed:
-                        for task in order.task_ids:
-                            task.write({'full_transit': True})
-                    else:
-                        for task in order.task_ids:
-                            task.write({'full_transit': False})
-            elif order.state in ['cancel', 'draft']:  # Si el pedido es cancelado o eliminado
-                for task in order.task_ids:
-                    task.write({'full_transit': False})
+                # Completo cuando ningún lote con el nombre de la tarea tiene stock disponible
+                completed = not any(task.lot_available_qty > 0 for task in order.task_ids)
+            else:  # Si el pedido es cancelado o eliminado
+                completed = False
+            for task in order.task_ids:
+                target[task] = completed
+
+        for value in (True, False):
+            tasks = self.env['project.task'].concat(*[
+                task for task, completed in target.items() if completed == value and task.full_transit != value
+            ])
+            if tasks:
+                tasks.write({'full_transit': value})
+
+    def _mark_full_transit_dirty(self):
+        """Anota los pedidos a revisar; check_and_update_order_status corre una vez antes del commit"""
+        order_ids = [order_id for order_id in self.ids if order_id]
+        if not order_ids:
+            return
+        data = self.env.cr.precommit.data
+        pending = data.get(PENDING_FULL_TRANSIT_KEY)
+        if pending is None:
+            pending = data[PENDING_FULL_TRANSIT_KEY] = set()
+            self.env.cr.precommit.add(self.env['sale.order'].sudo()._flush_pending_full_transit)
+        pending.update(order_ids)
+
+    @api.model
+    def _flush_pending_full_transit(self):
+        """Aplica la revisión pendiente de tránsito completo; llamarlo antes de leer full_transit en la misma transacción"""
+        order_ids = self.env.cr.precommit.data.pop(PENDING_FULL_TRANSIT_KEY, None)
+        if not order_ids:
+            return
+        self.browse(order_ids).exists().check_and_update_order_status()
+        self.env.flush_all()
 
     #@api.model
     def write(self, vals):
         res = super(SaleOrder, self).write(vals)
-        self.check_and_update_order_status()
+        if 'task_ids' in vals:
+            lines = self.env['account.move.line'].search([('sale_id', 'in', self.ids)])
+            lines.move_id._mark_task_relations_dirty()
+        if 'state' in vals or 'task_ids' in vals:
+            self._mark_full_transit_dirty()
         return res
 
     def unlink(self):
-        for order in self:
-            if order.state in ['cancel', 'draft']:
-                for task in order.task_ids:
-                    task.write({'full_transit': False})
+        tasks = self.filtered(lambda order: order.state in ['cancel', 'draft']).task_ids
+        tasks.filtered('full_transit').write({'full_transit': False})
         return super(SaleOrder, self).unlink()
     
     def action_create_outcome_invoice(self):
@@ -51,8 +80,9 @@ class SaleOrder(models.Model):
         return self._create_invoice('outcome_invoice_pack')
 
     def _create_invoice(self, product_pack_field):
+        # full_transit de las tareas debe reflejar los cambios de esta transacción
+        self._flush_pending_full_transit()
         account_move_obj = self.env['account.move']
-        account_move_line_obj = self.env['account.move.line']
 
         for order in self:
             # Validación de egreso_completo en las tareas asociadas
@@ -61,74 +91,64 @@ class SaleOrder(models.Model):
                     raise ValidationError(f"Este tránsito no se puede facturar porque está en 'Egreso Completo'. (Tarea: {task.name})")
 
             # Buscar productos asociados al campo específico
-            products = self.env['product.product'].search([('product_tmpl_id.' + product_pack_field, '=', True)])
+            products = self.env['product.template']._get_billing_pack_products(product_pack_field)
             if not products:
                 raise ValidationError('No hay productos configurados con el paquete solicitado.')
 
-            # Crear la factura
-            invoice = account_move_obj.create({
-                'partner_id': order.partner_id.id,
-                'move_type': 'out_invoice',  # Factura de cliente
-                'invoice_origin': order.name,
-            })
-            _logger.info(f"Factura creada con ID: {invoice.id} para el pedido {order.name} (ID: {order.id})")
-
-            # Agregar líneas de factura
-            for product in products:
-                if product.product_tmpl_id.one_line_invoice:
+            # Armar las líneas de factura
+            line_vals_list = []
+            for product, pack in products:
+                if pack.one_line_invoice:
                     # Agrupar tareas en una sola línea de factura
                     task_names = '-'.join(order.task_ids.mapped('name'))
-                    line_vals = {
-                        'move_id': invoice.id,
+                    line_vals_list.append({
                         'product_id': product.id,
                         'quantity': len(order.task_ids),  # Cantidad basada en el número de tareas
-                        'price_unit': product.lst_price,
+                        'price_unit': pack.lst_price,
                         'name': f"{product.name} - {task_names}",
-                        'account_id': product.categ_id.property_account_income_categ_id.id,
+                        'account_id': pack.account_id,
                         'sale_id': order.id,  # Relación con el pedido
                         'task_id': order.task_ids[0].id,  # Relación con una de las tareas
-                    }
-                    account_move_line_obj.create(line_vals)
-                    _logger.info(f"Línea de factura creada para producto con one_line_invoice: {product.name} - {task_names}")
+                    })
                 else:
                     for task in order.task_ids:
-                        line = account_move_line_obj.create({
-                            'move_id': invoice.id,
+                        line_vals_list.append({
                             'product_id': product.id,
                             'quantity': 1,  # Ajusta según sea necesario
-                            'price_unit': product.lst_price,
+                            'price_unit': pack.lst_price,
                             'name': f"{product.name} - {task.name}",
-                            'account_id': product.categ_id.property_account_income_categ_id.id,
+                            'account_id': pack.account_id,
                             'sale_id': order.id,  # Relación con el pedido
                             'task_id': task.id,  # Relación con la tarea
                         })
-                        _logger.info(f"Línea de factura creada con ID: {line.id}, relacionada con el pedido {order.name} (ID: {order.id}) y tarea {task.name} (ID: {task.id})")
-            
-            try:
-                invoice.button_update_prices_from_pricelist()
-            except Exception as e:
-                _logger.error(f"Error al actualizar precios para la factura {invoice.id}: {str(e)}")
 
             # Validar y agregar productos para tareas con full_transit
             full_transit_tasks = order.task_ids.filtered(lambda task: task.full_transit)
             if full_transit_tasks:
-                product_full_transit = self.env['product.product'].search([('product_tmpl_id.product_full_transit', '=', True)], limit=1)
-                if not product_full_transit:
+                full_transit_products = self.env['product.template']._get_billing_pack_products('product_full_transit')
+                if not full_transit_products:
                     raise ValidationError('No hay productos configurados con el campo product_full_transit en True.')
+                product_full_transit, full_transit_pack = full_transit_products[0]
 
                 task_names = '-'.join(full_transit_tasks.mapped('name'))
-                invoice_line_vals = {
-                    'move_id': invoice.id,
+                line_vals_list.append({
                     'product_id': product_full_transit.id,
                     'quantity': 1,
-                    'price_unit': product_full_transit.lst_price,
+                    'price_unit': full_transit_pack.lst_price,
                     'name': f"{product_full_transit.name} - {task_names}",
-                    'account_id': product_full_transit.categ_id.property_account_income_categ_id.id,
+                    'account_id': full_transit_pack.account_id,
                     'sale_id': order.id,  # Relación con el pedido
                     'task_id': full_transit_tasks[0].id,  # Relación con una de las tareas
-                }
-                account_move_line_obj.create(invoice_line_vals)
-                _logger.info(f"Línea de factura creada para tareas con full_transit: {task_names}")
+                })
+
+            # Crear la factura con sus líneas en un solo paso
+            invoice = account_move_obj._assemble_invoices([{
+                'partner_id': order.partner_id.id,
+                'move_type': 'out_invoice',  # Factura de cliente
+                'invoice_origin': order.name,
+                'invoice_line_ids': [(0, 0, line_vals) for line_vals in line_vals_list],
+            }])
+            _logger.info("Factura creada con ID: %s para el pedido %s (ID: %s) con %s líneas", invoice.id, order.name, order.id, len(line_vals_list))
 
             # Devolver una acción para abrir la factura recién creada
             return {
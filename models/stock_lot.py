@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class StockLot(models.Model):
+    _inherit = 'stock.lot'
+
+    def write(self, vals):
+        if 'name' in vals:
+            # Las tareas con el nombre anterior y con el nuevo cambian de stock disponible
+            self.env['project.task']._mark_lot_availability_dirty(self.mapped('name') + [vals['name']])
+        return super().write(vals)
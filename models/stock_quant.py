@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+
+class StockQuant(models.Model):
+    _inherit = 'stock.quant'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super().create(vals_list)
+        quants._mark_task_lot_availability_dirty()
+        return quants
+
+    def write(self, vals):
+        relevant = 'quantity' in vals or 'lot_id' in vals
+        if 'lot_id' in vals:
+            # El lote anterior también cambia de stock
+            self._mark_task_lot_availability_dirty()
+        res = super().write(vals)
+        if relevant:
+            self._mark_task_lot_availability_dirty()
+        return res
+
+    def unlink(self):
+        self._mark_task_lot_availability_dirty()
+        return super().unlink()
+
+    def _mark_task_lot_availability_dirty(self):
+        """El stock disponible de las tareas se indexa por el nombre del lote"""
+        lot_names = self.sudo().lot_id.mapped('name')
+        if lot_names:
+            self.env['project.task']._mark_lot_availability_dirty(lot_names)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+import logging
+
+from .batch_iteration import iter_record_chunks
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_BATCH_SIZE = 500
+
+
+class UpdateTaskRelationsJob(models.Model):
+    _name = 'update.task.relations.job'
+    _description = 'Trabajo de actualización de relaciones de tareas en facturas'
+    _order = 'id desc'
+
+    user_id = fields.Many2one('res.users', string='Usuario', default=lambda self: self.env.user, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('running', 'En proceso'),
+        ('done', 'Finalizado'),
+    ], string='Estado', default='pending', required=True, readonly=True)
+    batch_size = fields.Integer(string='Facturas por lote', default=DEFAULT_JOB_BATCH_SIZE, required=True)
+    last_move_id = fields.Integer(string='Última factura procesada', readonly=True,
+                                  help="Punto de control: el trabajo se reanuda desde la factura siguiente.")
+    total_count = fields.Integer(string='Facturas a procesar', readonly=True)
+    processed_count = fields.Integer(string='Facturas procesadas', readonly=True)
+    updated_count = fields.Integer(string='Facturas actualizadas', readonly=True)
+    error_count = fields.Integer(string='Errores', readonly=True)
+    error_log = fields.Text(string='Detalle de errores', readonly=True)
+    date_start = fields.Datetime(string='Inicio', readonly=True)
+    date_end = fields.Datetime(string='Fin', readonly=True)
+    progress = fields.Float(string='Avance (%)', compute='_compute_progress')
+
+    @api.depends('processed_count', 'total_count')
+    def _compute_progress(self):
+        for job in self:
+            job.progress = 100.0 * job.processed_count / job.total_count if job.total_count else 0.0
+
+    @api.model
+    def _enqueue(self, batch_size=DEFAULT_JOB_BATCH_SIZE):
+        job = self.create({
+            'batch_size': batch_size,
+            'total_count': self.env['account.move'].search_count([]),
+        })
+        cron = self.env.ref('dev_invoice.ir_cron_update_task_relations_job', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return job
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Procesa los trabajos pendientes o interrumpidos, reanudando desde su punto de control"""
+        for job in self.search([('state', 'in', ['pending', 'running'])], order='id'):
+            job._run()
+
+    def _run(self):
+        self.ensure_one()
+        moves_obj = self.env['account.move']
+        if self.state == 'pending':
+            self.write({'state': 'running', 'date_start': fields.Datetime.now()})
+            self.env.cr.commit()
+
+        # Se reanuda desde el punto de control; la caché se vacía entre lotes
+        for moves in iter_record_chunks(moves_obj, [], self.batch_size or DEFAULT_JOB_BATCH_SIZE, self.last_move_id):
+            # Un error en una factura no descarta el resto del lote
+            changed, failures = moves._update_task_relations_safe()
+            updated = len(changed)
+            errors = [f"Factura {move.id}: {str(e)}" for move, e in failures]
+
+            self.write({
+                'last_move_id': moves[-1].id,
+                'processed_count': self.processed_count + len(moves),
+                'updated_count': self.updated_count + updated,
+                'error_count': self.error_count + len(errors),
+                'error_log': '\n'.join(filter(None, [self.error_log] + errors)) or False,
+            })
+            # Un commit por lote junto con el punto de control
+            self.env.cr.commit()
+            _logger.info("Trabajo %s: %s/%s facturas procesadas", self.id, self.processed_count, self.total_count)
+
+        self.write({'state': 'done', 'date_end': fields.Datetime.now()})
+        self.env.cr.commit()
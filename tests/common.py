@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from odoo import fields
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+_logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+class DevInvoiceCommon(AccountTestInvoicingCommon):
+    """Base de los tests: productos de los paquetes de facturación y un proyecto de importación"""
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls._generate_pack_products()
+        cls.importation_project = cls.env['project.project'].create({'name': 'Importaciones', 'importation': True})
+
+    @classmethod
+    def _generate_pack_products(cls):
+        category = cls.env['product.category'].create({
+            'name': 'Facturación de tránsitos',
+            'property_account_income_categ_id': cls.company_data['default_account_revenue'].id,
+        })
+        common = {'type': 'service', 'categ_id': category.id, 'list_price': 10.0}
+        templates = []
+        for is_imo in (False, True):
+            suffix = ' IMO' if is_imo else ''
+            templates += [
+                dict(common, name='Almacenamiento' + suffix, stock_invoice_pack=True, is_storage=True,
+                     min_price=500.0, is_imo=is_imo),
+                dict(common, name='Seguro FOB' + suffix, stock_invoice_pack=True, fob_total=True,
+                     min_price=150.0, is_imo=is_imo),
+                dict(common, name='Manipuleo' + suffix, stock_invoice_pack=True, is_imo=is_imo),
+                dict(common, name='Ingreso' + suffix, income_invoice_pack=True, is_imo=is_imo),
+            ]
+        templates += [
+            dict(common, name='Egreso', outcome_invoice_pack=True, is_general=True),
+            dict(common, name='Egreso unificado', outcome_invoice_pack=True, one_line_invoice=True, is_general=True),
+            dict(common, name='Tránsito completo', product_full_transit=True),
+        ]
+        cls.pack_templates = cls.env['product.template'].create(templates)
+        cls.storage_product = cls.pack_templates.filtered(lambda t: t.is_storage and not t.is_imo).product_variant_id
+        cls.fob_product = cls.pack_templates.filtered(lambda t: t.fob_total and not t.is_imo).product_variant_id
+
+
+class DevInvoiceBenchmarkCommon(DevInvoiceCommon):
+    """Base de los benchmarks: genera un conjunto de datos sintético configurable.
+
+    Tamaños (variables de entorno):
+        DEV_INVOICE_BENCH_TASKS     tareas de importación (200)
+        DEV_INVOICE_BENCH_INVOICES  facturas publicadas con líneas de almacenamiento y FOB (100)
+        DEV_INVOICE_BENCH_ORDERS    pedidos de venta con tareas (20)
+        DEV_INVOICE_BENCH_REPORT    ruta del informe JSON (por defecto en el directorio temporal)
+    """
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.bench_sizes = {
+            'tasks': _env_int('DEV_INVOICE_BENCH_TASKS', 200),
+            'invoices': _env_int('DEV_INVOICE_BENCH_INVOICES', 100),
+            'orders': _env_int('DEV_INVOICE_BENCH_ORDERS', 20),
+        }
+        cls.bench_results = []
+        cls._generate_usd_rate()
+        cls._generate_tasks()
+        cls._generate_invoices()
+        cls._generate_sale_orders()
+        cls.env.flush_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._write_benchmark_report()
+        super().tearDownClass()
+
+    # ------------------------------------------------------------------
+    # Generación de datos
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def _generate_usd_rate(cls):
+        usd = cls.env.ref('base.USD')
+        usd.active = True
+        cls.env['res.currency.rate'].create({
+            'currency_id': usd.id,
+            'company_id': cls.env.company.id,
+            'name': fields.Date.today() - timedelta(days=1),
+            'rate': 1 / 900.0,
+        })
+
+    @classmethod
+    def _generate_tasks(cls):
+        size = cls.bench_sizes['tasks']
+        partners = cls.env['res.partner'].create([
+            {'name': 'Cliente %03d' % index, 'monthly_invoice': index % 2 == 0}
+            for index in range(max(1, size // 10))
+        ])
+        now = fields.Datetime.now()
+        cls.bench_tasks = cls.env['project.task'].create([{
+            'name': 'TR%06d' % index,
+            'project_id': cls.importation_project.id,
+            'partner_id': partners[index % len(partners)].id,
+            'fecha_ingreso': now - timedelta(days=30 + index % 90),
+            'total_fob': 10000 + index * 10,
+            'total_m3': 1 + index % 20,
+            'is_imo': index % 5 == 0,
+        } for index in range(size)])
+        cls.bench_partners = partners
+
+    @classmethod
+    def _generate_invoices(cls):
+        size = cls.bench_sizes['invoices']
+        tasks = cls.bench_tasks
+        # Facturas del período anterior: al publicarlas, la próxima facturación de sus tareas ya venció
+        invoice_date = fields.Date.today() - timedelta(days=40)
+        vals_list = []
+        for index in range(size):
+            task = tasks[index % len(tasks)]
+            vals_list.append({
+                'partner_id': task.partner_id.id,
+                'move_type': 'out_invoice',
+                'invoice_date': invoice_date,
+                'invoice_origin': 'Storage - %s' % task.name,
+                'invoice_line_ids': [
+                    (0, 0, {
+                        'product_id': cls.storage_product.id,
+                        'quantity': task.total_m3,
+                        'days_storage': 30,
+                        'calculate_custom': True,
+                        'price_unit': 10.0,
+                        'task_id': task.id,
+                    }),
+                    (0, 0, {
+                        'product_id': cls.fob_product.id,
+                        'quantity': 1,
+                        'fob_total': task.total_fob,
+                        'calculate_custom': True,
+                        'task_id': task.id,
+                    }),
+                ],
+            })
+        cls.bench_invoices = cls.env['account.move'].create(vals_list)
+        cls.bench_invoices.action_post()
+
+    @classmethod
+    def _generate_sale_orders(cls):
+        size = cls.bench_sizes['orders']
+        tasks = cls.bench_tasks
+        orders = cls.env['sale.order'].create([{
+            'partner_id': tasks[index % len(tasks)].partner_id.id,
+            'order_line': [(0, 0, {'product_id': cls.storage_product.id, 'product_uom_qty': 1})],
+        } for index in range(size)])
+        for index, order in enumerate(orders):
+            order_tasks = tasks.filtered(lambda task: task.partner_id == order.partner_id)[:3] or tasks[index % len(tasks)]
+            order.task_ids = [(6, 0, order_tasks.ids)]
+        cls.bench_orders = orders
+
+    # ------------------------------------------------------------------
+    # Medición e informe
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def measure(self, name, **extra):
+        """Mide tiempo y cantidad de consultas SQL del bloque, incluido el flush final"""
+        self.env.flush_all()
+        self.env.invalidate_all()
+        queries_before = self.env.cr.sql_log_count
+        start = time.perf_counter()
+        yield
+        self.env.flush_all()
+        result = dict(
+            name=name,
+            elapsed=round(time.perf_counter() - start, 4),
+            queries=self.env.cr.sql_log_count - queries_before,
+            **extra
+        )
+        type(self).bench_results.append(result)
+        _logger.info("Benchmark %(name)s: %(elapsed)ss, %(queries)s consultas", result)
+
+    @classmethod
+    def _write_benchmark_report(cls):
+        path = os.environ.get('DEV_INVOICE_BENCH_REPORT') or os.path.join(
+            tempfile.gettempdir(), 'dev_invoice_benchmark.json')
+        report = {
+            'date': fields.Datetime.to_string(fields.Datetime.now()),
+            'dataset': cls.bench_sizes,
+            'results': cls.bench_results,
+        }
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        _logger.info("Informe de benchmark escrito en %s", path)
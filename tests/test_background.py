@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.dev_invoice.models.project_task import DAYS_STORAGE_CURSOR_PARAM, STORAGE_BILLING_RUN_PARAM
+from odoo.addons.dev_invoice.models.sale_order_inherit import PENDING_FULL_TRANSIT_KEY
+
+from .common import DevInvoiceCommon
+
+
+@tagged('post_install', '-at_install')
+class TestDevInvoiceBackground(DevInvoiceCommon):
+    """Crons por lotes, trabajos encolados y refrescos diferidos hasta el commit"""
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.customer = cls.env['res.partner'].create({'name': 'Cliente de tránsitos'})
+        cls.tasks = cls.env['project.task'].create([{
+            'name': 'TR%06d' % index,
+            'project_id': cls.importation_project.id,
+            'partner_id': cls.customer.id,
+            'fecha_ingreso': fields.Datetime.now() - timedelta(days=45),
+            'total_fob': 10000,
+            'total_m3': 2,
+        } for index in range(1, 4)])
+
+    def setUp(self):
+        super().setUp()
+        # Los crons y los trabajos confirman por lotes; dentro del test todo queda en la transacción del caso
+        self.patch(type(self.env.cr), 'commit', lambda cr: None)
+        self.ICP = self.env['ir.config_parameter'].sudo()
+
+    # ------------------------------------------------------------------
+    # Crons con presupuesto y punto de control
+    # ------------------------------------------------------------------
+
+    def test_days_storage_cron_writes_changed_tasks(self):
+        closed = self.tasks[2]
+        closed.egreso_completo = True
+        self.env.flush_all()
+        self.env.cr.execute("UPDATE project_task SET days_to_invoiced = 999 WHERE id IN %s", [tuple(self.tasks.ids)])
+        self.env.invalidate_all()
+
+        self.env['project.task']._cron_update_days_storage(chunk_size=1, time_budget=0, record_budget=0)
+
+        for task in self.tasks[:2]:
+            self.assertEqual(task.days_to_invoiced, max(0, (task.days_storage or 0) - (task.days_invoiced or 0)))
+        # Las tareas cerradas quedan fuera del refresco
+        self.assertEqual(closed.days_to_invoiced, 999)
+        self.assertFalse(self.ICP.get_param(DAYS_STORAGE_CURSOR_PARAM))
+
+    def test_days_storage_cron_resumes_from_cursor(self):
+        first = self.env['project.task'].search([('billable_importation', '=', True)], order='id', limit=1)
+        self.env['project.task']._cron_update_days_storage(chunk_size=1, time_budget=0, record_budget=1)
+        # El presupuesto corta después del primer lote y deja el punto de control
+        self.assertEqual(int(self.ICP.get_param(DAYS_STORAGE_CURSOR_PARAM)), first.id)
+
+        self.env['project.task']._cron_update_days_storage(chunk_size=1, time_budget=0, record_budget=0)
+        self.assertFalse(self.ICP.get_param(DAYS_STORAGE_CURSOR_PARAM))
+
+    def test_storage_cron_continues_run_after_budget(self):
+        task_obj = self.env['project.task']
+        due = task_obj.search(task_obj._get_storage_billing_due_domain())
+        self.assertTrue(self.tasks <= due)
+
+        stats = task_obj._cron_generate_storage_invoices(batch_size=1, time_budget=0, record_budget=1)
+        self.assertEqual(stats['tasks'], 1)
+        self.assertTrue(stats['pending'])
+        run = self.env['project.task.billing.run'].browse(int(self.ICP.get_param(STORAGE_BILLING_RUN_PARAM)))
+        self.assertEqual(run.billing_type, 'storage')
+
+        stats = task_obj._cron_generate_storage_invoices(batch_size=1, time_budget=0, record_budget=0)
+        self.assertFalse(stats['pending'])
+        self.assertEqual(stats['tasks'], len(due) - 1)
+        self.assertFalse(self.ICP.get_param(STORAGE_BILLING_RUN_PARAM))
+        # Una sola corrida para todo el período, una línea facturada por tarea
+        self.assertEqual(run.line_ids.task_id, due)
+        self.assertEqual(set(run.line_ids.mapped('state')), {'done'})
+
+    # ------------------------------------------------------------------
+    # Trabajo de actualización de relaciones factura-tarea
+    # ------------------------------------------------------------------
+
+    def test_task_relations_job_processes_all_moves(self):
+        task = self.tasks[0]
+        invoice = self.env['account.move'].create({
+            'partner_id': self.customer.id,
+            'move_type': 'out_invoice',
+            'invoice_date': fields.Date.today(),
+            'invoice_line_ids': [(0, 0, {
+                'product_id': self.storage_product.id,
+                'quantity': 1,
+                'price_unit': 10.0,
+                'task_id': task.id,
+            })],
+        })
+        self.env['account.move']._flush_pending_task_relations()
+        self.assertEqual(invoice.task_id, task)
+        field = self.env['account.move']._fields['task_id']
+        self.env.cr.execute(f"DELETE FROM {field.relation} WHERE {field.column1} = %s", [invoice.id])
+        self.env.invalidate_all()
+        self.assertFalse(invoice.task_id)
+
+        job = self.env['update.task.relations.job']._enqueue(batch_size=2)
+        job._run()
+
+        self.assertRecordValues(job, [{
+            'state': 'done',
+            'processed_count': job.total_count,
+            'last_move_id': self.env['account.move'].search([], order='id desc', limit=1).id,
+            'error_count': 0,
+        }])
+        self.assertGreaterEqual(job.updated_count, 1)
+        invoice.invalidate_recordset(['task_id'])
+        self.assertEqual(invoice.task_id, task)
+
+    # ------------------------------------------------------------------
+    # Stock disponible de los lotes y tránsito completo
+    # ------------------------------------------------------------------
+
+    def _create_lot_stock(self, task, quantity):
+        product = self.env['product.product'].create({'name': 'Mercadería en tránsito', 'type': 'product', 'tracking': 'lot'})
+        lot = self.env['stock.lot'].create({'name': task.name, 'product_id': product.id, 'company_id': self.env.company.id})
+        location = self.env['stock.warehouse'].search([('company_id', '=', self.env.company.id)], limit=1).lot_stock_id
+        self.env['stock.quant']._update_available_quantity(product, location, quantity, lot_id=lot)
+        return product, lot, location
+
+    def test_lot_available_qty_follows_quants(self):
+        task = self.tasks[0]
+        product, lot, location = self._create_lot_stock(task, 5.0)
+        self.env['project.task']._flush_pending_lot_availability()
+        self.assertEqual(task.lot_available_qty, 5.0)
+
+        self.env['stock.quant']._update_available_quantity(product, location, -5.0, lot_id=lot)
+        self.env['project.task']._flush_pending_lot_availability()
+        self.assertEqual(task.lot_available_qty, 0.0)
+
+        self.env['stock.quant']._update_available_quantity(product, location, 3.0, lot_id=lot)
+        self.env['project.task']._flush_pending_lot_availability()
+        self.assertEqual(task.lot_available_qty, 3.0)
+        # Renombrar el lote también cambia el stock de la tarea
+        lot.name = 'OTRO-LOTE'
+        self.env['project.task']._flush_pending_lot_availability()
+        self.assertEqual(task.lot_available_qty, 0.0)
+
+    def test_full_transit_debounced_on_state_and_tasks(self):
+        in_stock, shipped = self.tasks[:2]
+        self._create_lot_stock(in_stock, 5.0)
+        order = self.env['sale.order'].create({'partner_id': self.customer.id})
+        order.task_ids = [(6, 0, shipped.ids)]
+        order.write({'state': 'sale'})
+        # La revisión queda pendiente hasta el commit (o hasta que alguien la necesita)
+        self.assertIn(order.id, self.env.cr.precommit.data[PENDING_FULL_TRANSIT_KEY])
+        self.env['sale.order']._flush_pending_full_transit()
+        self.assertTrue(shipped.full_transit)
+
+        # Cambios ajenos a estado y tareas no programan la revisión
+        order.write({'note': 'Sin cambios de tránsito'})
+        self.assertNotIn(PENDING_FULL_TRANSIT_KEY, self.env.cr.precommit.data)
+
+        # Una tarea con stock deja el pedido incompleto
+        order.task_ids = [(4, in_stock.id)]
+        self.env['sale.order']._flush_pending_full_transit()
+        self.assertFalse(shipped.full_transit)
+        self.assertFalse(in_stock.full_transit)
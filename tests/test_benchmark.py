@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+
+from odoo.addons.dev_invoice.models.cron_budget import CRON_TIME_BUDGET_PARAM
+
+from .common import DevInvoiceBenchmarkCommon
+
+
+@tagged('post_install', '-at_install', '-standard', 'benchmark')
+class TestDevInvoiceBenchmark(DevInvoiceBenchmarkCommon):
+    """Benchmarks de los puntos de entrada de facturación (``--test-tags benchmark``)"""
+
+    def setUp(self):
+        super().setUp()
+        # Los crons confirman por lotes; dentro del test todo queda en la transacción del caso
+        self.patch(type(self.env.cr), 'commit', lambda cr: None)
+        # Sin presupuesto de tiempo: cada cron procesa todo su trabajo en la ejecución medida
+        self.env['ir.config_parameter'].sudo().set_param(CRON_TIME_BUDGET_PARAM, 0)
+
+    def test_storage_cron(self):
+        # Las facturas de almacenamiento del conjunto de datos dejan la próxima facturación en el pasado
+        self.assertEqual(self.env['project.task'].search_count(
+            self.env['project.task']._get_storage_billing_due_domain() + [('id', 'in', self.bench_tasks.ids)]),
+            len(self.bench_tasks))
+        with self.measure('storage_cron', tasks=len(self.bench_tasks)):
+            stats = self.env['project.task']._cron_generate_storage_invoices()
+        self.assertEqual(stats['tasks'], len(self.bench_tasks))
+
+    def test_monthly_invoices(self):
+        with self.measure('monthly_invoices', tasks=len(self.bench_tasks)):
+            self.bench_tasks.action_generate_monthly_invoices()
+
+    def test_update_task_relations_full(self):
+        with self.measure('update_task_relations_full', invoices=len(self.bench_invoices)):
+            self.env['account.move']._cron_update_task_relations(full=True)
+
+    def test_update_task_relations_incremental(self):
+        self.env['account.move']._cron_update_task_relations(full=True)
+        with self.measure('update_task_relations_incremental', invoices=len(self.bench_invoices)):
+            self.env['account.move']._cron_update_task_relations()
+
+    def test_task_computes(self):
+        tasks = self.bench_tasks
+        with self.measure('compute_move_line_ids', tasks=len(tasks)):
+            tasks._compute_move_line_ids()
+        with self.measure('compute_transit_total_cost', tasks=len(tasks)):
+            tasks._compute_transit_total_cost()
+        with self.measure('compute_days_storage_invoiced', tasks=len(tasks)):
+            tasks._compute_days_storage_invoiced()
+        with self.measure('cron_update_days_storage', tasks=len(tasks)):
+            self.env['project.task']._cron_update_days_storage()
+
+    def test_sale_order_invoice(self):
+        with self.measure('sale_order_create_invoice', orders=len(self.bench_orders)):
+            for order in self.bench_orders:
+                order._create_invoice('outcome_invoice_pack')
+
+    def test_billing_forecast(self):
+        invoice_count = self.env['account.move'].search_count([])
+        with self.measure('billing_forecast_monthly', tasks=len(self.bench_tasks)):
+            rows = self.bench_tasks._forecast_billing('monthly')
+        self.assertTrue(rows)
+        # La previsión no crea facturas
+        self.assertEqual(self.env['account.move'].search_count([]), invoice_count)
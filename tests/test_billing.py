@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import os
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.dev_invoice.models.res_currency import USD_RATE_CACHE_KEY
+
+from .common import DevInvoiceCommon
+
+
+def _load_post_migration():
+    """Módulo de la migración 16.0.0.0 (el nombre del archivo no se puede importar directamente)"""
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations', '16.0.0.0', 'post-migration.py')
+    spec = importlib.util.spec_from_file_location('dev_invoice_post_migration', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@tagged('post_install', '-at_install')
+class TestDevInvoiceBilling(DevInvoiceCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.customer = cls.env['res.partner'].create({'name': 'Cliente de tránsitos'})
+        cls.task = cls._create_task('TR000001')
+        cls.ledger = cls.env['project.task.billing.run.line']
+
+    @classmethod
+    def _create_task(cls, name, project=None):
+        return cls.env['project.task'].create({
+            'name': name,
+            'project_id': (project or cls.importation_project).id,
+            'partner_id': cls.customer.id,
+            'fecha_ingreso': fields.Datetime.now() - timedelta(days=45),
+            'total_fob': 10000,
+            'total_m3': 2,
+        })
+
+    def _create_invoice(self, line_vals_list, **vals):
+        return self.env['account.move'].create(dict({
+            'partner_id': self.customer.id,
+            'move_type': 'out_invoice',
+            'invoice_date': fields.Date.today(),
+            'invoice_line_ids': [(0, 0, line_vals) for line_vals in line_vals_list],
+        }, **vals))
+
+    def _storage_line(self, quantity, days_storage, price_unit, task=None):
+        return {
+            'product_id': self.storage_product.id,
+            'quantity': quantity,
+            'days_storage': days_storage,
+            'calculate_custom': True,
+            'price_unit': price_unit,
+            'task_id': (task or self.task).id,
+        }
+
+    def _fob_line(self, fob_total, task=None):
+        return {
+            'product_id': self.fob_product.id,
+            'quantity': 1,
+            'fob_total': fob_total,
+            'calculate_custom': True,
+            'task_id': (task or self.task).id,
+        }
+
+    def _relation_pairs(self, moves):
+        field = self.env['account.move']._fields['task_id']
+        self.env.flush_all()
+        self.env.cr.execute(f"""
+            SELECT {field.column1}, {field.column2} FROM {field.relation} WHERE {field.column1} IN %s
+        """, [tuple(moves.ids)])
+        return set(self.env.cr.fetchall())
+
+    def _claim_storage(self, period):
+        run = self.env['project.task.billing.run'].create({'billing_type': 'storage', 'period': period})
+        tasks, last_id = self.env['project.task']._claim_storage_billing_batch(period, run, batch_size=1000)
+        return run, tasks
+
+    # ------------------------------------------------------------------
+    # Importes de las líneas personalizadas
+    # ------------------------------------------------------------------
+
+    def test_custom_line_amounts(self):
+        rate = self.env['res.currency']._get_usd_rate(self.env.company, fields.Date.today())
+        invoice = self._create_invoice([
+            self._storage_line(2, 30, 10.0),
+            self._storage_line(1, 10, 10.0),
+            self._fob_line(1000000),
+            self._fob_line(0),
+        ])
+        storage_above, storage_min, fob_above, fob_min = invoice.invoice_line_ids
+        fob_amount = max(1000000 * rate * 0.001, 150.0)
+        # Almacenamiento: el precio por m3 incluye los días (10 * 30) o sube hasta el mínimo (500 / 1 m3)
+        self.assertRecordValues(storage_above | storage_min, [
+            {'price_unit': 300.0, 'price_subtotal': 600.0},
+            {'price_unit': 500.0, 'price_subtotal': 500.0},
+        ])
+        # FOB: fob * tasa * 0.001, con el mínimo del producto, ya en el precio al insertar la línea
+        self.assertAlmostEqual(fob_above.price_unit, fob_amount, places=2)
+        self.assertAlmostEqual(fob_min.price_unit, 150.0)
+        # Los totales salen del motor contable (cantidad * precio)
+        self.assertAlmostEqual(invoice.amount_untaxed, 600.0 + 500.0 + fob_amount + 150.0, places=2)
+        self.assertAlmostEqual(-sum(invoice.invoice_line_ids.mapped('balance')), invoice.amount_untaxed, places=2)
+        self.assertRecordValues(storage_above | storage_min, [{'custom_subtotal': 600.0}, {'custom_subtotal': 500.0}])
+
+        # Cambiar días o cantidad recalcula desde la tarifa de lista: los días entran una sola vez
+        storage_min.write({'days_storage': 60})
+        self.assertRecordValues(storage_min, [{'price_unit': 600.0, 'price_subtotal': 600.0}])
+        storage_min.write({'quantity': 2})
+        self.assertRecordValues(storage_min, [{'price_unit': 600.0, 'price_subtotal': 1200.0}])
+        # Un precio escrito es la tarifa diaria
+        storage_min.write({'price_unit': 20.0})
+        self.assertRecordValues(storage_min, [{'price_unit': 1200.0, 'price_subtotal': 2400.0}])
+
+    # ------------------------------------------------------------------
+    # Cachés de tasas y de productos de paquetes
+    # ------------------------------------------------------------------
+
+    def test_usd_rate_cache_invalidated_on_rate_changes(self):
+        currency_obj = self.env['res.currency']
+        usd = self.env.ref('base.USD')
+        usd.active = True
+        today = fields.Date.today()
+        rate = self.env['res.currency.rate'].create({
+            'currency_id': usd.id,
+            'company_id': self.env.company.id,
+            'name': today,
+            'rate': 1 / 900.0,
+        })
+        self.assertAlmostEqual(currency_obj._get_usd_rate(self.env.company, today), 900.0)
+        self.assertIn((self.env.company.id, today), self.env.cr.precommit.data[USD_RATE_CACHE_KEY])
+
+        rate.rate = 1 / 1000.0
+        self.assertNotIn(USD_RATE_CACHE_KEY, self.env.cr.precommit.data)
+        self.assertAlmostEqual(currency_obj._get_usd_rate(self.env.company, today), 1000.0)
+
+        rate.unlink()
+        self.assertNotIn(USD_RATE_CACHE_KEY, self.env.cr.precommit.data)
+
+    def _pack_entries(self, pack_field, imo_filter=None):
+        return {entry.id: entry for product, entry in
+                self.env['product.template']._get_billing_pack_products(pack_field, imo_filter)}
+
+    def test_billing_pack_cache_invalidated_on_catalog_changes(self):
+        storage = self.storage_product
+        self.assertEqual(self._pack_entries('stock_invoice_pack', 'non_imo')[storage.id].min_price, 500.0)
+
+        storage.product_tmpl_id.min_price = 700.0
+        self.assertEqual(self._pack_entries('stock_invoice_pack', 'non_imo')[storage.id].min_price, 700.0)
+
+        # Cuenta de ingresos de la categoría
+        account = self.company_data['default_account_revenue'].copy()
+        storage.categ_id.property_account_income_categ_id = account
+        self.assertEqual(self._pack_entries('stock_invoice_pack', 'non_imo')[storage.id].account_id, account.id)
+
+        # Una plantilla que pasa a ser de paquete y una variante archivada
+        other = self.env['product.product'].create({'name': 'Control documental', 'type': 'service'})
+        self.assertNotIn(other.id, self._pack_entries('stock_invoice_pack'))
+        other.product_tmpl_id.stock_invoice_pack = True
+        self.assertIn(other.id, self._pack_entries('stock_invoice_pack'))
+        other.active = False
+        self.assertNotIn(other.id, self._pack_entries('stock_invoice_pack'))
+
+    # ------------------------------------------------------------------
+    # Relación factura-tarea
+    # ------------------------------------------------------------------
+
+    def test_rebuild_task_relations_matches_update(self):
+        other_project = self.env['project.project'].create({'name': 'General'})
+        sale_task = self._create_task('TR000002')
+        other_task = self._create_task('GEN000001', project=other_project)
+        order = self.env['sale.order'].create({'partner_id': self.customer.id})
+        order.task_ids = [(6, 0, (sale_task | other_task).ids)]
+        moves = self._create_invoice([self._storage_line(1, 30, 10.0)])
+        moves |= self._create_invoice([dict(self._storage_line(1, 30, 10.0, task=other_task), sale_id=order.id)])
+        moves |= self._create_invoice([{'product_id': self.storage_product.id, 'quantity': 1, 'price_unit': 10.0, 'sale_id': order.id}])
+
+        moves._update_task_relations()
+        expected = self._relation_pairs(moves)
+        self.assertEqual(expected, {
+            (moves[0].id, self.task.id),
+            (moves[1].id, sale_task.id),
+            (moves[2].id, sale_task.id),
+        })
+
+        field = self.env['account.move']._fields['task_id']
+        self.env.cr.execute(f"DELETE FROM {field.relation} WHERE {field.column1} IN %s", [tuple(moves.ids)])
+        self.env.invalidate_all()
+        _load_post_migration().migrate(self.env.cr, '16.0.0.0')
+        self.env.invalidate_all()
+        self.assertEqual(self._relation_pairs(moves), expected)
+
+    # ------------------------------------------------------------------
+    # Resumen de facturación y próxima facturación
+    # ------------------------------------------------------------------
+
+    def test_billing_summary_deltas(self):
+        invoice = self._create_invoice([self._storage_line(2, 30, 10.0)])
+        invoice.action_post()
+        self.assertRecordValues(self.task.billing_summary_ids, [{
+            'amount_billed': invoice.amount_untaxed_signed,
+            'days_billed': 30,
+        }])
+
+        invoice.button_draft()
+        self.assertRecordValues(self.task.billing_summary_ids, [{'amount_billed': 0.0, 'days_billed': 0}])
+
+        invoice.action_post()
+        self.assertRecordValues(self.task.billing_summary_ids, [{
+            'amount_billed': invoice.amount_untaxed_signed,
+            'days_billed': 30,
+        }])
+
+        invoice.button_draft()
+        invoice.unlink()
+        self.assertRecordValues(self.task.billing_summary_ids, [{'amount_billed': 0.0, 'days_billed': 0}])
+
+    def test_storage_invoice_sets_next_billing(self):
+        invoice_date = fields.Date.today() - timedelta(days=5)
+        invoice = self._create_invoice(
+            [self._storage_line(2, 30, 10.0)],
+            invoice_origin='Storage - %s' % self.task.name,
+            invoice_date=invoice_date,
+        )
+        invoice.action_post()
+        self.assertEqual(self.task.date_next_billing, invoice_date + timedelta(days=30))
+
+        invoice.button_draft()
+        invoice.unlink()
+        self.assertFalse(self.task.date_next_billing)
+
+    # ------------------------------------------------------------------
+    # Registro de facturación por tarea y período
+    # ------------------------------------------------------------------
+
+    def test_monthly_billing_is_idempotent(self):
+        invoices = self.task._generate_monthly_invoices()
+        self.assertEqual(len(invoices), 1)
+        self.assertRecordValues(self.ledger.search([('task_id', '=', self.task.id)]), [{
+            'billing_type': 'monthly',
+            'state': 'done',
+            'invoice_id': invoices.id,
+        }])
+        # Repetir la facturación en el mismo período no crea facturas
+        self.assertFalse(self.task._generate_monthly_invoices())
+
+    def test_monthly_billing_excludes_storage_billing(self):
+        period = self.env['project.task']._get_billing_period()
+        self.task._generate_monthly_invoices()
+        run, tasks = self._claim_storage(period)
+        self.assertNotIn(self.task, tasks)
+        self.assertFalse(self.ledger._reserve(run, self.task, 'storage', period))
+
+    def test_storage_billing_excludes_monthly_billing(self):
+        period = self.env['project.task']._get_billing_period()
+        run, tasks = self._claim_storage(period)
+        self.assertIn(self.task, tasks)
+        lines = self.ledger._reserve(run, self.task, 'storage', period)
+        products = self.env['product.template']._get_billing_pack_products('outcome_invoice_pack')
+        invoices = lines.task_id._generate_storage_invoices_batch(products, lines)
+        self.assertEqual(len(invoices), 1)
+        self.assertRecordValues(lines, [{'billing_type': 'storage', 'state': 'done', 'invoice_id': invoices.id}])
+        self.assertFalse(self.task._generate_monthly_invoices())
+        self.assertNotIn(self.task, self._claim_storage(period)[1])
+
+    def test_cancelled_invoice_allows_rebilling(self):
+        period = self.env['project.task']._get_billing_period()
+        invoices = self.task._generate_monthly_invoices()
+        invoices.button_cancel()
+        line = self.ledger.search([('task_id', '=', self.task.id)])
+        self.assertRecordValues(line, [{'state': 'failed', 'invoice_id': False}])
+        run, tasks = self._claim_storage(period)
+        self.assertIn(self.task, tasks)
+        lines = self.ledger._reserve(run, self.task, 'storage', period)
+        self.assertEqual(lines, line)
+        self.assertRecordValues(lines, [{'run_id': run.id, 'billing_type': 'storage'}])
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
 from . import project_task_days_invoiced_wizard
 from . import project_task_fecha_ingreso_wizard
-from . import update_task_relations_wizard
\ No newline at end of file
+from . import update_task_relations_wizard
+from . import billing_forecast_wizard
\ No newline at end of file
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import base64
+import csv
+import io
+import time
+from collections import defaultdict
+
+from odoo import models, fields, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class BillingForecastWizard(models.TransientModel):
+    _name = 'billing.forecast.wizard'
+    _description = 'Previsión de facturación'
+
+    def _default_task_ids(self):
+        if self.env.context.get('active_model') == 'project.task' and self.env.context.get('active_ids'):
+            return [(6, 0, self.env.context['active_ids'])]
+        # Sin selección: las tareas vencidas se buscan al calcular
+        return []
+
+    mode = fields.Selection([
+        ('monthly', 'Facturación mensual'),
+        ('storage', 'Factura de almacenamiento'),
+    ], string='Simular', default='monthly', required=True)
+    task_ids = fields.Many2many('project.task', string='Tareas', default=_default_task_ids)
+    task_count = fields.Integer(string='Tareas seleccionadas', compute='_compute_task_count')
+    forecast_file = fields.Binary(string='Archivo', readonly=True, attachment=False)
+    forecast_filename = fields.Char(string='Nombre del archivo', readonly=True)
+    invoice_count = fields.Integer(string='Facturas proyectadas', readonly=True)
+    partner_count = fields.Integer(string='Clientes', readonly=True)
+    amount_total = fields.Float(string='Importe proyectado', readonly=True)
+    error_count = fields.Integer(string='Tareas con error', readonly=True)
+
+    @api.depends('task_ids')
+    def _compute_task_count(self):
+        for wizard in self:
+            wizard.task_count = len(wizard.task_ids)
+
+    def _get_forecast_tasks(self):
+        """Tareas a simular: la selección o, si no hay, las tareas con facturación de almacenamiento vencida"""
+        if self.task_ids:
+            return self.task_ids
+        task_obj = self.env['project.task']
+        return task_obj.search(task_obj._get_storage_billing_due_domain(), order='id')
+
+    def action_compute_forecast(self):
+        """Calcula la previsión (sin crear facturas) y la deja para descargar en CSV"""
+        self.ensure_one()
+        start = time.monotonic()
+        tasks = self._get_forecast_tasks()
+        rows = tasks._forecast_billing(self.mode)
+        errors = [row for row in rows if row['error']]
+        rows = [row for row in rows if not row['error']]
+
+        totals = defaultdict(float)
+        for row in rows:
+            totals[row['partner_name']] += row['amount']
+
+        output = io.StringIO()
+        writer = csv.writer(output, delimiter=';')
+        writer.writerow(['Factura', 'Cliente', 'Tarea', 'Producto', 'Cantidad', 'Días', 'Precio unitario', 'Importe', 'Error'])
+        for row in rows:
+            writer.writerow([
+                row['invoice'], row['partner_name'], row['task_name'], row['product_name'],
+                row['quantity'], row['days_storage'], round(row['price_unit'], 6), round(row['amount'], 2), '',
+            ])
+        for row in errors:
+            writer.writerow(['', row['partner_name'], row['task_name'], '', '', '', '', '', row['error']])
+        writer.writerow([])
+        writer.writerow(['', 'Cliente', '', '', '', '', '', 'Total'])
+        for partner_name, amount in sorted(totals.items()):
+            writer.writerow(['', partner_name, '', '', '', '', '', round(amount, 2)])
+
+        self.write({
+            'forecast_file': base64.b64encode(output.getvalue().encode('utf-8-sig')),
+            'forecast_filename': f"prevision_{self.mode}_{fields.Date.context_today(self)}.csv",
+            'invoice_count': len({row['invoice'] for row in rows}),
+            'partner_count': len(totals),
+            'amount_total': sum(totals.values()),
+            'error_count': len(errors),
+        })
+        _logger.info("Previsión de facturación (%s): %s tareas, %s líneas, %s tareas con error en %.3fs",
+                     self.mode, len(tasks), len(rows), len(errors), time.monotonic() - start)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Previsión de facturación',
+            'res_model': self._name,
+            'view_mode': 'form',
+            'res_id': self.id,
+            'target': 'new',
+        }
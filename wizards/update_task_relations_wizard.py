@@ -1,4 +1,4 @@
-from odoo import models, api
+from odoo import models, fields, api
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -7,14 +7,35 @@ class UpdateTaskRelationsWizard(models.TransientModel):
     _name = 'update.task.relations.wizard'
     _description = 'Actualizar relaciones de tareas en facturas'
 
+    def _default_job_id(self):
+        return self.env['update.task.relations.job'].search([('state', '!=', 'done')], limit=1)
+
+    batch_size = fields.Integer(string='Facturas por lote', default=500, required=True)
+    job_id = fields.Many2one('update.task.relations.job', string='Trabajo', default=_default_job_id, readonly=True)
+    job_state = fields.Selection(related='job_id.state')
+    job_progress = fields.Float(related='job_id.progress')
+    job_total_count = fields.Integer(related='job_id.total_count')
+    job_processed_count = fields.Integer(related='job_id.processed_count')
+    job_updated_count = fields.Integer(related='job_id.updated_count')
+    job_error_count = fields.Integer(related='job_id.error_count')
+    job_error_log = fields.Text(related='job_id.error_log')
+
     def action_update_relations(self):
-        moves = self.env['account.move'].search([])
-        for move in moves:
-            try:
-                move._update_task_relations()
-                self.env.cr.commit()
-                _logger.info(f"Actualizada factura ID: {move.id}")
-            except Exception as e:
-                _logger.error(f"Error en factura ID {move.id}: {str(e)}")
-                self.env.cr.rollback()
-        return {'type': 'ir.actions.act_window_close'}
\ No newline at end of file
+        """Encola la actualización: se procesa por lotes en segundo plano y se puede reanudar"""
+        self.ensure_one()
+        self.job_id = self.env['update.task.relations.job']._enqueue(self.batch_size)
+        _logger.info("Encolado trabajo de actualización de relaciones ID: %s", self.job_id.id)
+        return self._reopen()
+
+    def action_refresh(self):
+        return self._reopen()
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Actualizar relaciones de tareas',
+            'res_model': self._name,
+            'view_mode': 'form',
+            'res_id': self.id,
+            'target': 'new',
+        }